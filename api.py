@@ -4,12 +4,14 @@ from typing import Optional
 from fastapi import FastAPI, Form, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-import datetime, os, time
+from starlette.background import BackgroundTask
+import os, shutil, tempfile, time
 
 import core
 
 
 app = FastAPI()
+_raspberrypi = None
 
 app.mount(
     "/webapp",
@@ -18,6 +20,12 @@ app.mount(
 )
 
 
+@app.on_event("startup")
+def load_application():
+    """This function loads the configs, total station, and saved state when the API starts."""
+    print(core.load_application())
+
+
 @app.get("/", status_code=301)
 async def redirect(response: Response):
     """This function redirects requests to the ShootPoints web interface."""
@@ -33,15 +41,18 @@ async def redirect(response: Response):
 @app.get("/raspberrypi/")
 async def check_for_raspberrypi():
     """This function checks that ShootPoints is running on a Raspberry Pi."""
-    raspberrypi = False
-    try:
-        with open("/proc/device-tree/model", "r") as f:
-            content = f.read()
-            if "Raspberry Pi" in content:
-                raspberrypi = True
-    except FileNotFoundError:
-        pass
-    return raspberrypi
+    global _raspberrypi
+    # The hardware can’t change while ShootPoints is running, so only check it once.
+    if _raspberrypi is None:
+        _raspberrypi = False
+        try:
+            with open("/proc/device-tree/model", "r") as f:
+                content = f.read()
+                if "Raspberry Pi" in content:
+                    _raspberrypi = True
+        except FileNotFoundError:
+            pass
+    return _raspberrypi
 
 
 @app.get("/raspberrypi/reboot/")
@@ -77,13 +88,13 @@ async def set_rpi_clock(
 
 
 @app.get("/configs/")
-async def get_configs():
+def get_configs():
     """This function gets the current configs in the configs.ini file and the available ports and total station models."""
     return core.get_configs()
 
 
 @app.put("/configs/", status_code=201)
-async def set_configs(
+def set_configs(
     response: Response,
     port: str = Form(None),
     make: str = Form(None),
@@ -180,21 +191,28 @@ async def delete_subclass(
 
 
 @app.get("/database/")
-async def download_entire_database():
+def download_entire_database():
     """This function downloads the ShootPoints database SQLite file in its entirety."""
-    date = str(datetime.datetime.now()).split(" ")[0]
-    core.exporters.export_database_file()
+    # Each export is built in a directory of its own, which is removed once the ZIP file has been sent,
+    # so that concurrent downloads can’t overwrite or delete each other’s files.
+    exportdir = tempfile.mkdtemp(dir="exports")
+    try:
+        date = core.exporters.export_database_file(exportdir)
+    except Exception:
+        shutil.rmtree(exportdir, ignore_errors=True)
+        raise
     return FileResponse(
-        "exports/database.zip",
+        os.path.join(exportdir, "database.zip"),
         media_type="application/zip",
         headers={
             "Content-Disposition": f"attachment; filename=ShootPoints Database {date}.zip"
         },
+        background=BackgroundTask(shutil.rmtree, exportdir, ignore_errors=True),
     )
 
 
 @app.get("/export/{sessions_id}")
-async def export_session_data(response: Response, sessions_id: int):
+def export_session_data(response: Response, sessions_id: int):
     """This function downloads a ZIP file of the requested session and its shots."""
     sql = "SELECT label FROM sessions WHERE id = ?"
     sessionlabel = (
@@ -203,13 +221,19 @@ async def export_session_data(response: Response, sessions_id: int):
         .replace(":", "_")
         .replace("\\", "_")
     )
-    core.exporters.export_session_data(sessions_id)
+    exportdir = tempfile.mkdtemp(dir="exports")
+    try:
+        core.exporters.export_session_data(sessions_id, exportdir)
+    except Exception:
+        shutil.rmtree(exportdir, ignore_errors=True)
+        raise
     return FileResponse(
-        "exports/export.zip",
+        os.path.join(exportdir, "export.zip"),
         media_type="application/zip",
         headers={
             "Content-Disposition": f"attachment; filename=ShootPoints Data ({sessionlabel}).zip"
         },
+        background=BackgroundTask(shutil.rmtree, exportdir, ignore_errors=True),
     )
 
 
@@ -220,7 +244,7 @@ async def get_setup_errors():
 
 
 @app.delete("/reset/")
-async def reset_database(
+def reset_database(
     preservesitesandstations: bool = Form(False),
     preserveclassesandsubclasses: bool = Form(False),
     ignore: str = Form("ignore"),
@@ -294,7 +318,7 @@ async def set_prism_offsets(
 
 
 @app.get("/site/")
-async def get_all_sites(response: Response):
+def get_all_sites(response: Response):
     """This function gets all the sites in the database."""
     outcome = core.sites.get_all_sites()
     if "errors" in outcome:
@@ -397,7 +421,7 @@ async def end_current_grouping(response: Response):
 
 
 @app.get("/livemap/")
-async def export_session_for_livemap(sessions_id: Optional[int] = None):
+def export_session_for_livemap(sessions_id: Optional[int] = None):
     """This function gets a survey data from a session to be plotted by leafletjs."""
     return core.survey.export_session_for_livemap(sessions_id)
 
@@ -409,7 +433,7 @@ async def get_current_session():
 
 
 @app.get("/sessions/")
-async def get_all_sessions():
+def get_all_sessions():
     """This function gets basic identifying information about all the surveying sessions in the database."""
     return core.survey.get_all_sessions()
 
@@ -535,7 +559,7 @@ def cancel_shot():
 
 
 @app.get("/station/{sites_id}")
-async def get_stations(response: Response, sites_id: int):
+def get_stations(response: Response, sites_id: int):
     """This function gets all the stations in the database at the indicated site."""
     outcome = core.tripod.get_stations(sites_id)
     if "errors" in outcome:
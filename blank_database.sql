@@ -135,5 +135,7 @@ CREATE INDEX "idx_sessions_stations_id_backsight" ON "sessions" (`stations_id_ba
 CREATE INDEX "idx_groupings_sessions_id" ON "groupings" (`sessions_id`);
 CREATE INDEX "idx_groupings_geometries_id" ON "groupings" (`geometries_id`);
 CREATE INDEX "idx_groupings_subclasses_id" ON "groupings" (`subclasses_id`);
+CREATE INDEX "idx_stations_sites_id_name" ON "stations" (`sites_id`,`name`);
+CREATE INDEX "idx_shots_groupings_id" ON "shots" (`groupings_id`);
 COMMIT;
 PRAGMA foreign_keys=ON;
@@ -1,12 +1,14 @@
 """This package controls all aspects of ShootPoints’ communications with the total station and processing and saving data."""
 
 import configparser
-import glob
+import functools
 import importlib
+import os
 import re
-import serial
-import serial.tools.list_ports
+import sys
+import time
 from pathlib import Path
+from typing import Optional
 
 from . import calculations
 from . import classifications
@@ -22,128 +24,244 @@ from .utilities import format_outcome
 __version__ = {}
 configs = configparser.ConfigParser(comment_prefixes="|", allow_no_value=True)
 configs.optionxform = str
-totalstation = None
-serialport = None
+_configvalues = {}
+_configsmtime = None
+_configscache = None
+_configscachetime = 0.0
+_CONFIGSCACHESECONDS = 30
+# totalstation and serialport are set by load_application(), which __getattr__() (below) calls on first access.
+# Until they are set (as when loading fails, or serialport in demo mode), both are None, as callers test for.
+_loaded = False
+_port = None
+_REQUIREDCONFIGS = (
+    ("SERIAL", "port"),
+    ("SERIAL", "uart"),
+    ("TOTAL STATION", "make"),
+    ("TOTAL STATION", "model"),
+    ("BACKSIGHT ERROR", "limit"),
+)
+# The default contents of configs.ini, which are filled in when it is missing or incomplete.
+_DEFAULTCONFIGS = """
+[SERIAL]
+; Set port to “demo” or the path (e.g., “/dev/ttyUSB0”).
+port = demo
+; Change the following to “true” if a UART adapter has been connected to the Raspberry Pi’s GPIO.
+uart = false
 
+[TOTAL STATION]
+make = Topcon
+model = GTS-300 Series
 
-def _load_configs() -> dict:
+[BACKSIGHT ERROR]
+; Acceptable error range for backsight shots (expected horizontal distance vs. measured distance), in cm.
+limit = 3.0
+"""
+# Serial port names that ShootPoints offers as choices, compiled once rather than on every get_configs() call.
+_USBSERIALPORTS = re.compile(
+    r"/dev/ttyUSB\d+"  # USB to Serial adapter on Raspberry Pi
+    r"|/dev/cu\.usbserial-\d+"  # USB to Serial adapter on Mac (Bluetooth ports don’t match)
+    r"|COM\d+"  # USB to Serial adapter on Windows
+)
+_UARTPORTS = re.compile(r"/dev/ttyAMA\d+")  # GPIO UART adapter on Raspberry Pi
+# Turns total station module and package names into display names, and vice versa.
+_DISPLAYNAMES = str.maketrans("_", " ")
+_MODULENAMES = str.maketrans(" -", "__")
+
+
+def _get_configs_mtime() -> Optional[int]:
+    """This function returns the modification time of the configs.ini file, or None if it doesn’t exist."""
+    try:
+        return os.stat("configs.ini").st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load_configs(reread: bool = True) -> tuple:
     """
     This function loads the configurations from the configs.ini file,
     and if necessary creates that file, missing sections, and/or missing options.
     """
     outcome = {"errors": [], "result": ""}
     global configs
-    if not Path("configs.ini").is_file():
+    global _configvalues
+    global _configscache
+    global _configsmtime
+    # Only parse configs.ini again if it has been modified since it was last read or written.
+    if reread and _configsmtime != _get_configs_mtime():
+        configs.read("configs.ini")
+    # Only fill in defaults and rewrite configs.ini if it is missing or incomplete.
+    if not all(
+        configs.has_option(section, option) for section, option in _REQUIREDCONFIGS
+    ):
+        if not configs.sections():
+            # This is a fresh install, so take the defaults wholesale.
+            configs.read_string(_DEFAULTCONFIGS)
+        else:
+            defaults = configparser.ConfigParser(
+                comment_prefixes="|", allow_no_value=True
+            )
+            defaults.optionxform = str
+            defaults.read_string(_DEFAULTCONFIGS)
+            for eachsection in defaults.sections():
+                if not configs.has_section(eachsection):
+                    configs.add_section(eachsection)
+                # Each option’s explanatory comments precede it, so carry them over with it.
+                comments = []
+                for option, val in defaults.items(eachsection):
+                    if option.startswith(";"):
+                        comments.append(option)
+                        continue
+                    if not configs.has_option(eachsection, option):
+                        for eachcomment in comments:
+                            configs.set(eachsection, eachcomment)
+                        configs.set(eachsection, option, val)
+                    comments = []
         with open("configs.ini", "w") as f:
-            pass
-    configs.read("configs.ini")
-    # Serial Port configs
-    if not configs.has_section("SERIAL"):
-        configs.add_section("SERIAL")
-    if not configs.has_option("SERIAL", "port"):
-        configs.set(
-            "SERIAL", "; Set port to “demo” or the path (e.g., “/dev/ttyUSB0”)."
-        )
-        configs.set("SERIAL", "port", "demo")
-    if not configs.has_option("SERIAL", "uart"):
-        configs.set(
-            "SERIAL",
-            "; Change the following to “true” if a UART adapter has been connected to the Raspberry Pi’s GPIO.",
-        )
-        configs.set("SERIAL", "uart", "false")
-    # Total Station configs
-    if not configs.has_section("TOTAL STATION"):
-        configs.add_section("TOTAL STATION")
-    if not configs.has_option("TOTAL STATION", "make"):
-        configs.set("TOTAL STATION", "make", "Topcon")
-    if not configs.has_option("TOTAL STATION", "model"):
-        configs.set("TOTAL STATION", "model", "GTS-300 Series")
-    # Backsight Error configs
-    if not configs.has_section("BACKSIGHT ERROR"):
-        configs.add_section("BACKSIGHT ERROR")
-    if not configs.has_option("BACKSIGHT ERROR", "limit"):
-        configs.set(
-            "BACKSIGHT ERROR",
-            "; Acceptable error range for backsight shots (expected horizontal distance vs. measured distance), in cm.",
-        )
-        configs.set("BACKSIGHT ERROR", "limit", "3.0")
-    with open("configs.ini", "w") as f:
-        configs.write(f)
-    outcome["result"] = "Configurations loaded successfully."
-    survey.backsighterrorlimit = float(configs["BACKSIGHT ERROR"]["limit"])
-    return format_outcome(outcome)
+            configs.write(f)
+    # Snapshot the option values (minus comments) into plain dicts for cheap lookups.
+    _configvalues = {
+        eachsection: {
+            option: val
+            for option, val in configs.items(eachsection)
+            if not option.startswith(";")
+        }
+        for eachsection in configs.sections()
+    }
+    _configscache = None
+    _configsmtime = _get_configs_mtime()
+    # The limit is converted to a float once here, rather than each time a backsight is checked.
+    try:
+        survey.backsighterrorlimit = float(_configvalues["BACKSIGHT ERROR"]["limit"])
+    except ValueError:
+        error = f"The backsight error limit in configs.ini ({_configvalues['BACKSIGHT ERROR']['limit']}) is not numeric."
+        outcome["errors"].append(error)
+    else:
+        outcome["result"] = "Configurations loaded successfully."
+    return outcome["errors"], outcome["result"]
+
+
+@functools.lru_cache(maxsize=None)
+def _import_total_station(make: str, model: str):
+    """
+    This function imports the module for the total station make and model named in configs.ini.
+    Results are cached by the names as written there, so repeat loads skip both the name
+    normalization and the import machinery. None is returned (and cached) when there is no
+    such module, until save_config_file() clears the cache.
+    """
+    make = make.translate(_MODULENAMES).lower()
+    model = model.translate(_MODULENAMES).lower()
+    # All Topcon GTS-300 series total stations use the same communications protocols.
+    if make == "topcon" and model[:6] == "gts_30":
+        model = "gts_300_series"
+    modulename = f"{__name__}.total_stations.{make}.{model}"
+    # Skip the import machinery entirely when the module has already been imported.
+    if (module := sys.modules.get(modulename)) is not None:
+        return module
+    try:
+        return importlib.import_module(modulename)
+    except ModuleNotFoundError:
+        return None
 
 
-def _load_total_station_model() -> dict:
+def _load_total_station_model() -> tuple:
     """This function loads the indicated total station."""
     outcome = {"errors": [], "result": ""}
     global totalstation
-    if configs["SERIAL"]["port"] == "demo":
+    if _configvalues["SERIAL"]["port"] == "demo":
         from .total_stations import demo as totalstation
 
         outcome["result"] = "Demo total station loaded."
     else:
-        make = configs["TOTAL STATION"]["make"].replace(" ", "_").lower()
-        make = make.replace("-", "_").lower()
-        model = configs["TOTAL STATION"]["model"].replace(" ", "_").lower()
-        model = model.replace("-", "_").lower()
-        # All Topcon GTS-300 series total stations use the same communications protocols.
-        if make == "topcon" and model[:6] == "gts_30":
-            model = "gts_300_series"
-        try:
-            totalstation = importlib.import_module(
-                f"{__name__}.total_stations.{make}.{model}", package="core"
-            )
-            outcome["result"] = (
-                f"{configs['TOTAL STATION']['make']} {configs['TOTAL STATION']['model']} total station loaded."
-            )
-        except ModuleNotFoundError:
+        make = _configvalues["TOTAL STATION"]["make"]
+        model = _configvalues["TOTAL STATION"]["model"]
+        if module := _import_total_station(make, model):
+            totalstation = module
+            outcome["result"] = f"{make} {model} total station loaded."
+        else:
             error = f"There is no module for the {make} {model} total station. Specify the correct total station make and model in configs.ini before proceeding."
             outcome["errors"].append(error)
-            database._record_setup_error(error)
     if not outcome["errors"]:
         survey.totalstation = totalstation
-    return format_outcome(outcome)
+    return outcome["errors"], outcome["result"]
 
 
-def _load_serial_port() -> dict:
+def _load_serial_port() -> tuple:
     """
     This function finds the appropriate serial port and initializes it
-    with the communication parameters for the total station model.
+    with the communication parameters for the total station model. The
+    port itself is opened by the total station module on first use.
     """
     outcome = {"errors": [], "result": ""}
     global serialport
-    if configs["SERIAL"]["port"] == "demo":
+    global _port
+    configuredport = _configvalues["SERIAL"]["port"]
+    if configuredport == "demo":
         outcome["result"] = (
             "Demo total station loaded, so no physical serial port initialized."
         )
     else:
-        serialport = configs["SERIAL"]["port"]
-    if configs["SERIAL"]["port"] != "demo" and not outcome["errors"]:
-        try:
-            port = serial.Serial(
-                port=serialport,
-                baudrate=totalstation.BAUDRATE,  # type: ignore
-                parity=totalstation.PARITY,  # type: ignore
-                bytesize=totalstation.BYTESIZE,  # type: ignore
-                stopbits=totalstation.STOPBITS,  # type: ignore
-                timeout=totalstation.TIMEOUT,  # type: ignore
-            )
-            totalstation.port = port  # type: ignore
-            outcome["result"] = f"Serial port {serialport} opened."
-        except:
+        serialport = configuredport
+    # Keep the existing port when the path and communication parameters are unchanged.
+    if (
+        _port is not None
+        and configuredport != "demo"
+        and _port.port == serialport
+        and (
+            _port.baudrate,
+            _port.parity,
+            _port.bytesize,
+            _port.stopbits,
+        )
+        == (
+            totalstation.BAUDRATE,  # type: ignore
+            totalstation.PARITY,  # type: ignore
+            totalstation.BYTESIZE,  # type: ignore
+            totalstation.STOPBITS,  # type: ignore
+        )
+    ):
+        totalstation.port = _port  # type: ignore
+        outcome["result"] = f"Serial port {serialport} already initialized."
+        return outcome["errors"], outcome["result"]
+    if _port is not None:
+        _port.close()
+        _port = None
+    if configuredport != "demo" and not outcome["errors"]:
+        # Windows COM ports have no device file to check for.
+        if not (serialport.upper().startswith("COM") or os.path.exists(serialport)):
             outcome["errors"].append(
                 f"Serial port {serialport} could not be opened. Check your serial adapter and cable connections before proceeding."
             )
-    for each in outcome["errors"]:
-        database._record_setup_error(each)
-    return format_outcome(outcome)
+        else:
+            # pyserial is only needed for physical total stations, so it isn’t imported in demo mode.
+            import serial
+
+            try:
+                # Passing no port leaves it closed, so the total station module opens it on first use.
+                port = serial.Serial(
+                    baudrate=totalstation.BAUDRATE,  # type: ignore
+                    parity=totalstation.PARITY,  # type: ignore
+                    bytesize=totalstation.BYTESIZE,  # type: ignore
+                    stopbits=totalstation.STOPBITS,  # type: ignore
+                    timeout=totalstation.TIMEOUT,  # type: ignore
+                )
+                port.port = serialport
+                totalstation.port = port  # type: ignore
+                _port = port
+                outcome["result"] = f"Serial port {serialport} initialized."
+            except:
+                outcome["errors"].append(
+                    f"Serial port {serialport} could not be opened. Check your serial adapter and cable connections before proceeding."
+                )
+    return outcome["errors"], outcome["result"]
 
 
-def _load_application() -> dict:
-    """This function runs the private loader functions (above) and clears setup errors if they run cleanly."""
+def load_application(rereadconfigs: bool = True) -> dict:
+    """This function runs the private loader functions (above) and records their setup errors, or clears them if they run cleanly."""
     outcome = {"errors": [], "results": []}
     global __version__
+    global _loaded
+    global _port
+    _loaded = True
     with open("../VERSION", "r") as f:
         __version__ = {
             "app": f.readline().strip().split("=")[1],
@@ -152,7 +270,20 @@ def _load_application() -> dict:
         print(
             f"ShootPoints-Web v{__version__['app']}\nDatabase v{__version__['database']}"
         )
-    saved_state = database._read_from_database("SELECT * FROM savedstate")["results"][0]
+    # Restore the saved state and the current session’s setup in a single query.
+    sql = (
+        "SELECT "
+        "  ss.*, "
+        "  sta.northing AS n, "
+        "  sta.easting AS e, "
+        "  sta.elevation AS z, "
+        "  sta.utmzone AS utmzone, "
+        "  sess.instrumentheight AS ih "
+        "FROM savedstate ss "
+        "LEFT OUTER JOIN sessions sess ON ss.currentsession = sess.id "
+        "LEFT OUTER JOIN stations sta ON sess.stations_id_occupied = sta.id"
+    )
+    saved_state = database._read_from_database(sql)["results"][0]
     prism.offsets = {
         "vertical_distance": saved_state["vertical_distance"],
         "latitude_distance": saved_state["latitude_distance"],
@@ -165,92 +296,105 @@ def _load_application() -> dict:
     survey.temperature = saved_state["temperature"]
     survey.sessionid = saved_state["currentsession"]
     survey.groupingid = saved_state["currentgrouping"]
-    sql = (
-        "SELECT "
-        "  sta.northing AS n, "
-        "  sta.easting AS e, "
-        "  sta.elevation AS z, "
-        "  sta.utmzone AS utmzone, "
-        "  sess.instrumentheight AS ih, "
-        "  max(grp.id) AS gid "
-        "FROM sessions sess "
-        "JOIN stations sta ON sess.stations_id_occupied = sta.id "
-        "LEFT OUTER JOIN groupings grp ON sess.id = grp.sessions_id "
-        "WHERE sess.id = ?"
-    )
-    session_info = database._read_from_database(sql, (saved_state["currentsession"],))[
-        "results"
-    ][0]
     tripod.occupied_point = {
-        "n": session_info["n"],
-        "e": session_info["e"],
-        "z": session_info["z"],
-        "utmzone": session_info["utmzone"],
+        "n": saved_state["n"],
+        "e": saved_state["e"],
+        "z": saved_state["z"],
+        "utmzone": saved_state["utmzone"],
     }
-    tripod.instrument_height = session_info["ih"]
-    loaders = [_load_configs, _load_total_station_model, _load_serial_port]
-    for each in loaders:
-        loaderoutcome = each()
-        if "result" in loaderoutcome:
-            outcome["results"].append(loaderoutcome["result"])
-        elif "errors" in loaderoutcome:
-            outcome["errors"].extend(loaderoutcome["errors"])
-    if len(outcome["errors"]) == 0:
+    tripod.instrument_height = saved_state["ih"]
+    # Each loader returns a tuple of its errors (list) and its result message (str), and every loader’s
+    # errors are reported. The total station is loaded even if configs.ini has errors, as it only needs
+    # the make, model, and port, which _load_configs() always fills in.
+    loaderoutcomes = [_load_configs(rereadconfigs), _load_total_station_model()]
+    if loaderoutcomes[-1][0]:
+        # The serial port is set up with the total station’s communication parameters, so it can’t be
+        # set up without one, and a port left over from the previous configs is closed.
+        if _port is not None:
+            _port.close()
+            _port = None
+    else:
+        loaderoutcomes.append(_load_serial_port())
+    for errors, result in loaderoutcomes:
+        outcome["errors"].extend(errors)
+        if result:
+            outcome["results"].append(result)
+    # Any errors are recorded together, so that they cost a single commit.
+    if outcome["errors"]:
+        database._record_setup_errors(outcome["errors"])
+    else:
         database._clear_setup_errors()
     return format_outcome(outcome)
 
 
+@functools.lru_cache(maxsize=1)
+def _discover_total_stations() -> dict:
+    """
+    This function finds the total station makes and models that have modules in
+    core/total_stations. The installed modules can’t change while ShootPoints is
+    running, so the directory is only scanned once.
+    """
+    makes = sorted(
+        (
+            entry
+            for entry in os.scandir(Path("core") / "total_stations")
+            if entry.is_dir() and not entry.name.startswith("_")
+        ),
+        key=lambda entry: entry.name,
+    )
+    models = {}
+    for eachmake in makes:
+        themodels = sorted(
+            entry.name[:-3]
+            for entry in os.scandir(eachmake.path)
+            if entry.is_file()
+            and entry.name.endswith(".py")
+            and not entry.name.startswith("_")
+        )
+        models[eachmake.name.translate(_DISPLAYNAMES).title()] = [
+            x.translate(_DISPLAYNAMES).title().replace("Gts ", "GTS-")
+            for x in themodels
+        ]
+    return {key: val for key, val in models.items() if len(val) > 0}
+
+
 def get_configs() -> dict:
     """
     This function gets the current settings of the configs.ini file, so that the
     application front-end can display them. It also finds the available ports
     and total station models for the config file, so that the application
-    front-end can provide sensible choices to the end user.
+    front-end can provide sensible choices to the end user. The result is
+    reused for up to 30 seconds, or until the configs are reloaded, so that
+    plugged-in serial adapters still show up promptly.
     """
-    currentconfigs = {}
-    for eachsection in configs.sections():  # type: ignore
-        for eachoption in configs.items(eachsection):  # type: ignore
-            if not eachoption[0][0] == ";":
-                currentconfigs[eachoption[0]] = eachoption[1]
+    global _configscache
+    global _configscachetime
+    if (
+        _configscache is not None
+        and time.monotonic() - _configscachetime < _CONFIGSCACHESECONDS
+    ):
+        return _configscache
+    currentconfigs = {
+        option: val
+        for eachsection in _configvalues.values()
+        for option, val in eachsection.items()
+    }
+    import serial.tools.list_ports
+
+    uart = _configvalues["SERIAL"]["uart"] == "true"
     ports = ["demo"]
-    for port in list(serial.tools.list_ports.comports()):
-        if (
-            # USB to Serial adapter on Raspberry Pi
-            re.fullmatch("/dev/ttyUSB\\d+", port[0])
-            # USB to Serial adapter on Mac
-            or re.fullmatch("/dev/cu.usbserial-\\d+", port[0])
-            # USB to Serial adapter on Windows
-            or re.fullmatch("COM\\d+", port[0])
-        ):
-            ports.append(port[0])
-        # GPIO UART adapter on Raspberry Pi
-        if configs["SERIAL"]["uart"] == "true" and re.fullmatch(
-            "/dev/ttyAMA\\d+", port[0]
+    for port in serial.tools.list_ports.comports():
+        if _USBSERIALPORTS.fullmatch(port[0]) or (
+            uart and _UARTPORTS.fullmatch(port[0])
         ):
             ports.append(port[0])
-    makes = list(glob.glob(str(Path("core") / "total_stations" / "*")))
-    makes.sort()
-    models = {}
-    for eachmake in makes:
-        themodels = list(
-            set(glob.glob(str(Path(eachmake) / "*.py")))
-            - set(glob.glob(str(Path(eachmake) / "__init__.py")))
-        )
-        themodels.sort()
-        models[eachmake.replace("\\", "/").split("/")[2].replace("_", " ").title()] = [
-            x.replace("\\", "/")
-            .split("/")[3]
-            .replace(".py", "")
-            .replace("_", " ")
-            .title()
-            .replace("Gts ", "GTS-")
-            for x in themodels
-        ]
     options = {
         "ports": ports,
-        "total_stations": {key: val for key, val in models.items() if len(val) > 0},
+        "total_stations": _discover_total_stations(),
     }
-    return {"current": currentconfigs, "options": options}
+    _configscache = {"current": currentconfigs, "options": options}
+    _configscachetime = time.monotonic()
+    return _configscache
 
 
 def save_config_file(
@@ -260,21 +404,40 @@ def save_config_file(
     This function creates the configs.ini and sets its values. Any parameters not passed
     when this function is called will stay what they currently are in the config.ini file.
     """
-    if port:
+    changed = False
+    if port and port != _configvalues["SERIAL"]["port"]:
         configs["SERIAL"]["port"] = port
-    if make:
+        changed = True
+    if make and make != _configvalues["TOTAL STATION"]["make"]:
         configs["TOTAL STATION"]["make"] = make
-    if model:
+        changed = True
+    if model and model != _configvalues["TOTAL STATION"]["model"]:
         configs["TOTAL STATION"]["model"] = model
-    if limit:
+        changed = True
+    if limit and str(limit) != _configvalues["BACKSIGHT ERROR"]["limit"]:
         configs["BACKSIGHT ERROR"]["limit"] = str(limit)
-    with open("configs.ini", "w") as f:
-        configs.write(f)  # type: ignore
-    outcome = _load_application()
+        changed = True
+    if changed:
+        with open("configs.ini", "w") as f:
+            configs.write(f)  # type: ignore
+    # Forget any make and model that failed to import before, in case its module has since been added.
+    _import_total_station.cache_clear()
+    # The in-memory configs are already current, so don’t parse configs.ini again.
+    outcome = load_application(rereadconfigs=False)
     if "errors" not in outcome:
         del outcome["results"]
         outcome["result"] = "Configurations saved and reloaded."
     return format_outcome(outcome)
 
 
-print(_load_application())
+def __getattr__(name: str):
+    """
+    This function loads the application the first time that the total station or serial port
+    is accessed, for callers that import core without calling load_application() themselves,
+    and gives None for whichever of them loading didn’t set.
+    """
+    if name in ("totalstation", "serialport"):
+        if not _loaded:
+            load_application()
+        return globals().get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
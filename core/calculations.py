@@ -7,78 +7,70 @@ from . import tripod
 from . import prism
 
 
-def _calculate_radial_offset(measurement: dict, offset: float) -> tuple:
+_PPM = 1e-6  # one part per million
+
+
+def _round_to_mm(distance: float) -> float:
+    """
+    This function rounds a distance in meters to the nearest millimeter (halves round up).
+    It runs on every shot, and is about twice as fast as round(distance, 3).
+    """
+    return math.floor(distance * 1000 + 0.5) / 1000
+
+
+def _calculate_radial_offset(
+    delta_n: float, delta_e: float, distance_to_prism: float, offset: float
+) -> tuple:
     """This function calculates the northing and easting change due to toward/away radial prism offsets."""
     if not offset:
         return 0, 0
-    horizontal_distance = math.hypot(measurement["delta_n"], measurement["delta_e"])
-    proportion = offset / horizontal_distance
-    n_diff = measurement["delta_n"] * proportion
-    e_diff = measurement["delta_e"] * proportion
+    proportion = offset / distance_to_prism
+    n_diff = delta_n * proportion
+    e_diff = delta_e * proportion
     return n_diff, e_diff
 
 
-def _calculate_tangent_offset(measurement: dict, offset: float) -> tuple:
-    """This function calculates the northing and easting change due to left/right prism offsets tangential the circle's radius at the prism."""
+def _calculate_tangent_offset(
+    delta_n: float,
+    delta_e: float,
+    distance_to_prism: float,
+    azimuth_to_prism: float,
+    offset: float,
+) -> tuple:
+    """
+    This function calculates the northing and easting change due to left/right prism offsets tangential
+    the circle's radius at the prism. The azimuth to the prism is in radians.
+    """
     if not offset:
         return 0, 0
-    azimuth_to_prism = _calculate_azimuth(
-        (0, 0), (measurement["delta_n"], measurement["delta_e"])
-    )[0]
-    distance_to_prism = math.hypot(measurement["delta_n"], measurement["delta_e"])
     distance_to_point = math.hypot(distance_to_prism, offset)
-    offset_angle = math.degrees(
-        math.acos(
-            (distance_to_prism**2 + distance_to_point**2 - offset**2)
-            / (2 * distance_to_prism * distance_to_point)
-        )
-    )
-    if offset < 0:
-        offset_angle *= -1
-    azimuth_to_point = azimuth_to_prism + offset_angle
-    # Correct azimuth when the offset moves it across due north
-    if azimuth_to_point < 0:
-        azimuth_to_point += 360
-    elif azimuth_to_point > 360:
-        azimuth_to_point -= 360
-    n_diff = (
-        distance_to_point
-        * (math.sin(math.radians(90 - azimuth_to_point)) / math.sin(math.radians(90)))
-        - measurement["delta_n"]
-    )
-    e_diff = (
-        distance_to_point
-        * (math.sin(math.radians(azimuth_to_point)) / math.sin(math.radians(90)))
-        - measurement["delta_e"]
-    )
+    # The offset is at a right angle to the line of sight, so atan2 gives its angle (and sign) directly.
+    azimuth_to_point = azimuth_to_prism + math.atan2(offset, distance_to_prism)
+    n_diff = distance_to_point * math.cos(azimuth_to_point) - delta_n
+    e_diff = distance_to_point * math.sin(azimuth_to_point) - delta_e
     return n_diff, e_diff
 
 
-def _calculate_wedge_offset(measurement: dict, offset: float) -> tuple:
-    """This function calculates the northing and easting change due to cw/ccw wedge prism offsets on the circle's radius."""
+def _calculate_wedge_offset(
+    delta_n: float,
+    delta_e: float,
+    distance_to_prism: float,
+    azimuth_to_prism: float,
+    offset: float,
+) -> tuple:
+    """
+    This function calculates the northing and easting change due to cw/ccw wedge prism offsets on the
+    circle's radius. The azimuth to the prism is in radians.
+    """
     if not offset:
         return 0, 0
-    azimuth_to_prism = _calculate_azimuth(
-        (0, 0), (measurement["delta_n"], measurement["delta_e"])
-    )[0]
-    distance_to_prism = math.hypot(measurement["delta_n"], measurement["delta_e"])
-    # Note: distance_to_point = distance_to_prism
-    offset_angle = math.degrees(
-        math.acos(((2 * distance_to_prism**2) - offset**2) / (2 * distance_to_prism**2))
-    )
-    if offset < 0:
-        offset_angle *= -1
+    # Note: distance_to_point = distance_to_prism, so the offset is a chord of the circle and subtends
+    # 2·asin(offset / 2r). This is the law of cosines rearranged, but it keeps its precision for small
+    # offsets and takes its sign from the offset directly.
+    offset_angle = 2 * math.asin(offset / (2 * distance_to_prism))
     azimuth_to_point = azimuth_to_prism + offset_angle
-    if azimuth_to_point < 0:
-        azimuth_to_point += 360
-    elif azimuth_to_point > 360:
-        azimuth_to_point -= 360
-    n_diff = (
-        distance_to_prism * math.cos(math.radians(azimuth_to_point))
-    ) - measurement["delta_n"]
-    e_diff = (
-        distance_to_prism * math.sin(math.radians(azimuth_to_point))
-    ) - measurement["delta_e"]
+    n_diff = distance_to_prism * math.cos(azimuth_to_point) - delta_n
+    e_diff = distance_to_prism * math.sin(azimuth_to_point) - delta_e
     return n_diff, e_diff
 
 
@@ -92,13 +84,11 @@ def _apply_atmospheric_correction(
     """
     p = pressure * 106.036
     t = temperature + 273.15
-    Ka = (279.66 - (p / t)) * pow(10, -6)
-    measurement["delta_n"] += measurement["delta_n"] * Ka
-    measurement["delta_e"] += measurement["delta_e"] * Ka
-    measurement["delta_z"] += measurement["delta_z"] * Ka
-    measurement["delta_n"] = round(measurement["delta_n"], 3)
-    measurement["delta_e"] = round(measurement["delta_e"], 3)
-    measurement["delta_z"] = round(measurement["delta_z"], 3)
+    Ka = (279.66 - (p / t)) * _PPM
+    # Scaling by (1 + Ka) applies the correction and rounds to the millimeter with one lookup per axis.
+    scale = 1 + Ka
+    for axis in ("delta_n", "delta_e", "delta_z"):
+        measurement[axis] = _round_to_mm(measurement[axis] * scale)
     return measurement
 
 
@@ -108,40 +98,64 @@ def _apply_offsets_to_measurement(measurement: dict) -> dict:
     and prism offsets to the measurement returned from the total station (which
     assumes that its coordinates are 0, 0, 0).
     """
+    offsets = prism.offsets
+    occupied_point = tripod.occupied_point
+    delta_n = measurement["delta_n"]
+    delta_e = measurement["delta_e"]
+    # The calculated coordinates are built up in locals and only stored in the measurement once rounded.
     # Apply the occupied point offsets
-    measurement["calculated_n"] = measurement["delta_n"] + tripod.occupied_point["n"]
-    measurement["calculated_e"] = measurement["delta_e"] + tripod.occupied_point["e"]
-    measurement["calculated_z"] = measurement["delta_z"] + tripod.occupied_point["z"]
+    calculated_n = delta_n + occupied_point["n"]
+    calculated_e = delta_e + occupied_point["e"]
+    calculated_z = measurement["delta_z"] + occupied_point["z"]
     # Apply the instrument height offset
-    measurement["calculated_z"] += tripod.instrument_height
+    calculated_z += tripod.instrument_height
     # Apply the prism vertical offset
-    measurement["calculated_z"] += prism.offsets["vertical_distance"]
+    calculated_z += offsets["vertical_distance"]
     # Apply the prism absolute offsets
-    measurement["calculated_n"] += prism.offsets["latitude_distance"]
-    measurement["calculated_e"] += prism.offsets["longitude_distance"]
-    # Apply the prism relative offsets
-    radial_n_diff, radial_e_diff = _calculate_radial_offset(
-        measurement,
-        prism.offsets["radial_distance"],
-    )
-    measurement["calculated_n"] += radial_n_diff
-    measurement["calculated_e"] += radial_e_diff
-    tangent_n_diff, tangent_e_diff = _calculate_tangent_offset(
-        measurement,
-        prism.offsets["tangent_distance"],
-    )
-    measurement["calculated_n"] += tangent_n_diff
-    measurement["calculated_e"] += tangent_e_diff
-    wedge_n_diff, wedge_e_diff = _calculate_wedge_offset(
-        measurement,
-        prism.offsets["wedge_distance"],
-    )
-    measurement["calculated_n"] += wedge_n_diff
-    measurement["calculated_e"] += wedge_e_diff
+    calculated_n += offsets["latitude_distance"]
+    calculated_e += offsets["longitude_distance"]
+    # Apply the prism relative offsets, all of which use the same horizontal distance and azimuth
+    # to the prism, so those are only computed once (and only when a relative offset is set)
+    radial = offsets["radial_distance"]
+    tangent = offsets["tangent_distance"]
+    wedge = offsets["wedge_distance"]
+    if radial or tangent or wedge:
+        distance_to_prism = math.hypot(delta_n, delta_e)
+        # The azimuth stays in radians, as it only goes to cos() and sin(), which don’t mind it crossing due north.
+        azimuth_to_prism = math.atan2(delta_e, delta_n)
+        if radial:
+            radial_n_diff, radial_e_diff = _calculate_radial_offset(
+                delta_n,
+                delta_e,
+                distance_to_prism,
+                radial,
+            )
+            calculated_n += radial_n_diff
+            calculated_e += radial_e_diff
+        if tangent:
+            tangent_n_diff, tangent_e_diff = _calculate_tangent_offset(
+                delta_n,
+                delta_e,
+                distance_to_prism,
+                azimuth_to_prism,
+                tangent,
+            )
+            calculated_n += tangent_n_diff
+            calculated_e += tangent_e_diff
+        if wedge:
+            wedge_n_diff, wedge_e_diff = _calculate_wedge_offset(
+                delta_n,
+                delta_e,
+                distance_to_prism,
+                azimuth_to_prism,
+                wedge,
+            )
+            calculated_n += wedge_n_diff
+            calculated_e += wedge_e_diff
     # Round the calculated values to the nearest millimeter
-    measurement["calculated_n"] = round(measurement["calculated_n"], 3)
-    measurement["calculated_e"] = round(measurement["calculated_e"], 3)
-    measurement["calculated_z"] = round(measurement["calculated_z"], 3)
+    measurement["calculated_n"] = _round_to_mm(calculated_n)
+    measurement["calculated_e"] = _round_to_mm(calculated_e)
+    measurement["calculated_z"] = _round_to_mm(calculated_z)
     return measurement
 
 
@@ -149,27 +163,16 @@ def _calculate_azimuth(point_a: tuple, point_b: tuple) -> tuple:
     """This function returns the azimuth in decimal degrees and D, M, S between two points (aN, aE) and (bN, bE)."""
     delta_n = point_b[0] - point_a[0]
     delta_e = point_b[1] - point_a[1]
-    azimuth = math.degrees(math.atan2(delta_e, delta_n))
-    if azimuth < 0.0:
-        azimuth += 360.0
-    degrees, remainder = divmod(azimuth, 1)
-    minutes, remainder = divmod(remainder * 60, 1)
-    seconds = round(remainder * 60)
-    degrees, minutes, seconds = int(degrees), int(minutes), int(seconds)
-    if seconds == 60:
-        seconds = 0
-        minutes += 1
-    if minutes == 60:
-        minutes = 0
-        degrees += 1
-    if degrees == 360:
-        degrees = 0
-    return (
-        azimuth,
-        degrees,
-        minutes,
-        seconds,
-    )
+    azimuth = math.degrees(math.atan2(delta_e, delta_n)) % 360
+    return (azimuth, *_convert_decimal_degrees_to_dms(azimuth))
+
+
+def _convert_decimal_degrees_to_dms(angle: float) -> tuple:
+    """This function splits an angle in decimal degrees (0–360) into whole degrees, minutes, and seconds."""
+    # Rounding to whole seconds first lets integer division carry any rollover into the minutes and degrees.
+    degrees, seconds = divmod(round(angle * 3600), 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return degrees % 360, minutes, seconds
 
 
 def _calculate_coordinates_by_resection(
@@ -183,26 +186,36 @@ def _calculate_coordinates_by_resection(
     measurements to two points with known coordinates. From the point of view of the
     occupied point (P3), P0 is the known station to the left, and P1 is the one to the
     right. r0 and r1 are the measured distances to those two points, respectively.
+    A ValueError is raised if those distances can’t both be true, as no point is that
+    far from both P0 and P1.
 
     The math in this routine is from the “Intersection of Two Circles” example
     on the website http://paulbourke.net/geometry/circlesphere/
     """
-    # The distance between P0 and P1
-    d = math.hypot(P0[0] - P1[0], P0[1] - P1[1])
+    # The offsets from P0 to P1, and the distance between them
+    dx = P1[0] - P0[0]
+    dy = P1[1] - P0[1]
+    d = math.hypot(dx, dy)
+    if d > r0 + r1 or d < abs(r0 - r1):
+        raise ValueError(
+            "the measured distances to the backsight stations don’t meet at a common point"
+        )
+    inv_d = 1 / d
     # The length of the left segment of d where it intersects the perpendicular to the unknown point
-    a = (r0**2 - r1**2 + d**2) / (2 * d)
+    r0_squared = r0 * r0
+    a = (r0_squared - r1 * r1 + d * d) * 0.5 * inv_d
     # The length of the leg from occupied_point, perpendicular to d
-    # Note: this might throw an error if the three points are in a line
-    h = math.sqrt(abs(r0**2 - a**2))
+    # Note: this is 0 when the three points are in a line, and rounding could otherwise take it below that
+    h = math.sqrt(max(r0_squared - a * a, 0))
     # The XY coordinates of the point where the leg from point P3 intersects d
     P2 = (
-        P0[0] + a * (P1[0] - P0[0]) / d,
-        P0[1] + a * (P1[1] - P0[1]) / d,
+        P0[0] + a * dx * inv_d,
+        P0[1] + a * dy * inv_d,
     )
     # Finally, find the XY coordinates of P3
     P3 = (
-        round(P2[0] + h * (P1[1] - P0[1]) / d, 3),
-        round(P2[1] - h * (P1[0] - P0[0]) / d, 3),
+        round(P2[0] + h * dy * inv_d, 3),
+        round(P2[1] - h * dx * inv_d, 3),
     )
     return P3
 
@@ -6,42 +6,92 @@ from . import database
 from .utilities import format_outcome
 
 
+# Subclasses that the app itself relies on, by id, which are refused before the database is touched.
+_PROTECTEDSUBCLASSES = {1: "Survey Station"}
+
+_GETCLASSESSQL = "SELECT * FROM classes ORDER BY name"
+_GETSUBCLASSESSQL = (
+    "SELECT id, name, description FROM subclasses WHERE classes_id = ? ORDER BY name"
+)
+_INSERTCLASSSQL = "INSERT INTO classes (name, description) VALUES(?, ?)"
+_INSERTSUBCLASSSQL = (
+    "INSERT INTO subclasses (classes_id, name, description) VALUES(?, ?, ?)"
+)
+_DELETECLASSSQL = "DELETE FROM classes WHERE id = ? RETURNING name"
+_DELETESUBCLASSSQL = (
+    "DELETE FROM subclasses WHERE classes_id = ? AND id = ? RETURNING name"
+)
+
+# Classes and subclasses rarely change, so their query results are cached until one is saved or deleted,
+# or until reset_database() replaces the database (which is noticed through database._generation).
+_classescache = None
+_subclassescache = {}
+_cachegeneration = None
+
+
+def _clear_cache() -> None:
+    """This function discards the cached classes and subclasses, so that they are re-read on next use."""
+    global _classescache
+    global _cachegeneration
+    _classescache = None
+    _subclassescache.clear()
+    _cachegeneration = database._generation
+
+
 def get_all_classes() -> dict:
     """This function returns all the classes in the database."""
+    global _classescache
     outcome = {"errors": [], "results": []}
-    classes = database._read_from_database("SELECT * FROM classes ORDER BY name")
-    if "errors" not in classes:
-        outcome["classes"] = classes["results"]
-    else:
-        outcome["errors"] = classes["errors"]
+    if _cachegeneration != database._generation:
+        _clear_cache()
+    if _classescache is None:
+        classes = database._read_from_database(_GETCLASSESSQL)
+        if "errors" in classes:
+            outcome["errors"] = classes["errors"]
+            return format_outcome(outcome, ["results"])
+        _classescache = classes["results"]
+    outcome["classes"] = _classescache
     return format_outcome(outcome, ["results"])
 
 
 def get_subclasses(classes_id: int) -> dict:
     """This function returns all the subclasses in the database for the indicated class."""
     outcome = {"errors": [], "results": []}
-    subclasses = database._read_from_database(
-        "SELECT id, name, description FROM subclasses WHERE classes_id = ? ORDER BY name",
-        (classes_id,),
-    )
-    if "errors" not in subclasses:
-        outcome["subclasses"] = subclasses["results"]
-    else:
-        outcome["errors"] = subclasses["errors"]
+    if _cachegeneration != database._generation:
+        _clear_cache()
+    if classes_id not in _subclassescache:
+        subclasses = database._read_from_database(_GETSUBCLASSESSQL, (classes_id,))
+        if "errors" in subclasses:
+            outcome["errors"] = subclasses["errors"]
+            return format_outcome(outcome, ["subclasses"])
+        if not subclasses["results"]:
+            # Ids without subclasses aren’t cached, so that requests for made-up ids can’t grow the cache.
+            outcome["subclasses"] = []
+            return format_outcome(outcome, ["subclasses"])
+        _subclassescache[classes_id] = subclasses["results"]
+    outcome["subclasses"] = _subclassescache[classes_id]
     return format_outcome(outcome, ["subclasses"])
 
 
+def _normalize_name_and_description(name: str, description: Optional[str]) -> tuple:
+    """This function tidies the name and description of a new class or subclass before it is saved."""
+    return name.strip().title(), description.strip() if description else None
+
+
 def save_new_class(name: str, description: Optional[str] = None) -> dict:
     """This function saves a new class to the database."""
     outcome = {"errors": [], "results": ""}
-    name = name.strip().title()
-    description = description.strip() if description else None
-    sql = "INSERT INTO classes (name, description) VALUES(?, ?)"
-    newclass = database._save_to_database(sql, (name, description))
-    if "errors" not in newclass:
-        outcome["result"] = f"Class “{name}” saved."
+    name, description = _normalize_name_and_description(name, description)
+    if name:
+        newclass = database._save_to_database(_INSERTCLASSSQL, (name, description))
+        if "errors" not in newclass:
+            outcome["result"] = f"Class “{name}” saved."
+            _clear_cache()
+        else:
+            outcome["errors"] = newclass["errors"]
     else:
-        outcome["errors"] = newclass["errors"]
+        # A blank name is rejected here, without a round trip to the database.
+        outcome["errors"].append("No class name was given.")
     return format_outcome(outcome)
 
 
@@ -50,85 +100,68 @@ def save_new_subclass(
 ) -> dict:
     """This function saves a new subclass to the database."""
     outcome = {"errors": [], "results": ""}
-    name = name.strip().title()
-    description = description.strip() if description else None
-    sql = "INSERT INTO subclasses (classes_id, name, description) VALUES(?, ?, ?)"
-    newclass = database._save_to_database(sql, (classes_id, name, description))
-    if "errors" not in newclass:
-        outcome["result"] = f"Sublass “{name}” saved."
+    name, description = _normalize_name_and_description(name, description)
+    if name:
+        newclass = database._save_to_database(
+            _INSERTSUBCLASSSQL, (classes_id, name, description)
+        )
+        if "errors" not in newclass:
+            outcome["result"] = f"Sublass “{name}” saved."
+            _clear_cache()
+        else:
+            outcome["errors"] = newclass["errors"]
     else:
-        outcome["errors"] = newclass["errors"]
+        outcome["errors"].append("No subclass name was given.")
     return format_outcome(outcome)
 
 
 def delete_class(id: int) -> dict:
     """This function deletes the indicated class from the database."""
     outcome = {"errors": [], "results": ""}
-    exists = database._read_from_database(
-        "SELECT name FROM classes WHERE id = ?", (id,)
-    )
-    if "errors" not in exists:
-        if exists[
-            "results"
-        ]:  # This is an empty list if there are no matches for the above query.
-            name = exists["results"][0]["name"]
-            sql = "DELETE FROM classes WHERE id = ?"
-            deleted = database._delete_from_database(sql, (id,))
-            if "errors" not in deleted:
-                outcome["result"] = f"Class “{name}” successfully deleted."
-            else:
-                outcome["errors"] = deleted["errors"]
-            try:
-                if outcome["errors"][0] == "FOREIGN KEY constraint failed":
-                    outcome["errors"][
-                        0
-                    ] = f"Class “{name}” could not be deleted because it has one or more subclasses."
-            except IndexError:
-                pass
+    # The deleted class’s name comes back from the DELETE itself, so there’s no need to look it up first.
+    deleted = database._delete_from_database(_DELETECLASSSQL, (id,))
+    if "errors" in deleted:
+        if deleted["errors"][0] == "FOREIGN KEY constraint failed":
+            name = database._read_scalar("SELECT name FROM classes WHERE id = ?", (id,))
+            outcome["errors"].append(
+                f"Class “{name}” could not be deleted because it has one or more subclasses."
+            )
         else:
-            outcome["errors"].append(f"Class id {id} does not exist.")
+            outcome["errors"] = deleted["errors"]
+    elif deleted["results"]:
+        name = deleted["results"][0]["name"]
+        outcome["result"] = f"Class “{name}” successfully deleted."
+        _clear_cache()
     else:
-        outcome["errors"] = exists["errors"]
+        outcome["errors"].append(f"Class id {id} does not exist.")
     return format_outcome(outcome)
 
 
 def delete_subclass(classes_id: int, id: int) -> dict:
     """This function deletes the indicated subclass from the database."""
     outcome = {"errors": [], "results": ""}
-    if id == 1:
+    if id in _PROTECTEDSUBCLASSES:
         outcome["errors"].append(
-            "The Survey Station subclass (id 1) cannot be deleted."
+            f"The {_PROTECTEDSUBCLASSES[id]} subclass (id {id}) cannot be deleted."
         )
     else:
-        exists = database._read_from_database(
-            "SELECT name FROM subclasses WHERE classes_id = ? AND id = ?",
-            (
-                classes_id,
-                id,
-            ),
-        )
-        if "errors" not in exists:
-            if exists[
-                "results"
-            ]:  # This is an empty list if there are no matches for the above query.
-                name = exists["results"][0]["name"]
-                sql = "DELETE FROM subclasses WHERE id = ?"
-                deleted = database._delete_from_database(sql, (id,))
-                if "errors" not in deleted:
-                    outcome["result"] = f"Subclass “{name}” successfully deleted."
-                else:
-                    outcome["errors"] = deleted["errors"]
-                try:
-                    if outcome["errors"][0] == "FOREIGN KEY constraint failed":
-                        outcome["errors"][
-                            0
-                        ] = f"Subclass “{name}” could not be deleted because it is the subclass of one or more groupings."
-                except IndexError:
-                    pass
-            else:
+        deleted = database._delete_from_database(_DELETESUBCLASSSQL, (classes_id, id))
+        if "errors" in deleted:
+            if deleted["errors"][0] == "FOREIGN KEY constraint failed":
+                name = database._read_scalar(
+                    "SELECT name FROM subclasses WHERE id = ?", (id,)
+                )
                 outcome["errors"].append(
-                    f"Subclass id {id} does not exist or is not a subclass of class id {classes_id}."
+                    f"Subclass “{name}” could not be deleted because it is the subclass of one or more groupings."
                 )
+            else:
+                outcome["errors"] = deleted["errors"]
+        elif deleted["results"]:
+            name = deleted["results"][0]["name"]
+            outcome["result"] = f"Subclass “{name}” successfully deleted."
+            _clear_cache()
         else:
-            outcome["errors"] = exists["errors"]
+            outcome["errors"].append(
+                f"Subclass id {id} does not exist or is not a subclass of class id {classes_id}."
+            )
     return format_outcome(outcome)
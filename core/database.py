@@ -1,35 +1,239 @@
 """This module handles reading from and writing to the ShootPoints database."""
 
+import atexit
 import datetime
 import os
 import shutil
 import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
 from .survey import end_current_session
 from .utilities import format_outcome
 
 
-dbconn = sqlite3.connect("ShootPoints.db", check_same_thread=False)
-dbconn.row_factory = sqlite3.Row
-cursor = dbconn.cursor()
-try:
-    cursor.execute("SELECT 1 FROM stations")
-except sqlite3.OperationalError:
-    # ShootPoints.db database is empty, so initialize it with the default schema.
+_local = threading.local()
+# Every thread’s connection is tracked so that reset_database() can close them all before replacing the file.
+# Only weak references are kept here, so that a connection is closed and freed when its thread ends.
+_connections = weakref.WeakSet()
+_connectionslock = threading.Lock()
+# Writes from different threads queue up on this lock, rather than in SQLite’s busy handler, which
+# sleeps in growing steps while it waits for the database to be unlocked.
+_writelock = threading.Lock()
+# Reads check in and out here, so that reset_database() can wait for those in progress to finish, and hold
+# off new ones, while it replaces the database file. (Writes are held off by _writelock.)
+_readcondition = threading.Condition()
+_activereads = 0
+_readsheldoff = False
+_generation = 0
+# Setup errors, as cached by get_setup_errors(); None means they need to be read from the database.
+_setuperrors = None
+# The database is opened (and created if need be) on first use rather than when this module is imported.
+_schemachecked = False
+# DELETE … RETURNING needs SQLite 3.35, which is newer than some Raspberry Pi OS releases ship with.
+_HASRETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# Indexes that were added to blank_database.sql after its first release, for databases created before them.
+_ADDEDINDEXESSQL = (
+    'CREATE INDEX IF NOT EXISTS "idx_stations_sites_id_name" ON "stations" (`sites_id`,`name`)',
+    'CREATE INDEX IF NOT EXISTS "idx_shots_groupings_id" ON "shots" (`groupings_id`)',
+)
+
+
+class _Connection(sqlite3.Connection):
+    """This class is sqlite3.Connection, which can’t be weakly referenced, made able to be held in _connections."""
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    This function opens the ShootPoints database in WAL mode, so that readers don’t block
+    on writers, and tunes it for the per-thread connections used by the app.
+    """
+    # Writes within the app queue on _writelock, so the busy timeout only covers waits on other processes
+    # and on checkpoints, which are allowed longer than sqlite3’s default 5 s.
+    conn = sqlite3.connect(
+        "ShootPoints.db", timeout=30, check_same_thread=False, factory=_Connection
+    )
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    except sqlite3.OperationalError:
+        # WAL needs write access to the database directory, so fall back to the default rollback journal.
+        pass
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA mmap_size = 67108864")
+    conn.execute("PRAGMA cache_size = -20000")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+@lru_cache(maxsize=None)
+def _get_blank_database() -> sqlite3.Connection:
+    """
+    This function builds the pristine database from blank_database.sql in memory, once, so that new
+    and reset databases can be copied from it page by page rather than re-running the script.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
     with open("blank_database.sql", "r") as f:
-        cursor.executescript(f.read())
-        dbconn.commit()
-cursor.execute("PRAGMA foreign_keys = ON")
+        conn.executescript(f.read())
+    return conn
+
+
+def _create_schema_if_empty(conn: sqlite3.Connection) -> None:
+    """
+    This function initializes ShootPoints.db with the default schema if it is empty, or else adds
+    any indexes that are missing from databases created with an older blank_database.sql.
+    """
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stations'"
+    ).fetchone():
+        _get_blank_database().backup(conn)
+    else:
+        try:
+            for sql in _ADDEDINDEXESSQL:
+                conn.execute(sql)
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass
+
+
+def _get_cursor() -> sqlite3.Cursor:
+    """
+    This function returns the cursor of the calling thread’s own database connection,
+    opening it on first use (or after reset_database() has replaced the database file).
+    """
+    global _schemachecked
+    if getattr(_local, "generation", None) != _generation:
+        conn = _connect()
+        with _connectionslock:
+            if not _schemachecked:
+                _create_schema_if_empty(conn)
+                _schemachecked = True
+            _connections.add(conn)
+        _local.cursor = conn.cursor()
+        _local.generation = _generation
+        # Only this thread’s local data holds the cursor, so it is freed when the thread ends (as the
+        # threadpool retires idle worker threads), or when the thread reconnects, closing the connection.
+        # (It is left open at exit, for _optimize_database().)
+        weakref.finalize(_local.cursor, conn.close).atexit = False
+    return _local.cursor
+
+
+def _close_connections() -> None:
+    """
+    This function closes every thread’s database connection. It is only called by reset_database(),
+    with writes and reads held off, and each thread reconnects once the generation has been bumped.
+    """
+    global _setuperrors
+    _setuperrors = None
+    with _connectionslock:
+        for conn in list(_connections):
+            conn.close()
+        _connections.clear()
+
+
+@contextmanager
+def _reading():
+    """This function gives a cursor for reading, which reset_database() won’t close until the read is over."""
+    global _activereads
+    with _readcondition:
+        if not getattr(_local, "reads", 0):
+            # A read nested in one that is already in progress mustn’t wait, or it would hold up the reset it waits on.
+            _readcondition.wait_for(lambda: not _readsheldoff)
+        _activereads += 1
+    _local.reads = getattr(_local, "reads", 0) + 1
+    try:
+        yield _get_cursor()
+    finally:
+        _local.reads -= 1
+        with _readcondition:
+            _activereads -= 1
+            _readcondition.notify_all()
+
+
+@contextmanager
+def _holding_off_reads():
+    """This function waits for the reads in progress to finish, and holds off new ones until the block ends."""
+    global _readsheldoff
+    with _readcondition:
+        _readsheldoff = True
+        _readcondition.wait_for(lambda: not _activereads)
+    try:
+        yield
+    finally:
+        with _readcondition:
+            _readsheldoff = False
+            _readcondition.notify_all()
+
+
+@contextmanager
+def _writing():
+    """
+    This function gives a cursor for writing, once any other thread’s write is over, in a transaction that
+    is committed when the block ends, or rolled back so that a failed write doesn’t leave it (and the
+    database’s write lock) open on this thread’s connection. The cursor is only fetched once the write
+    lock is held, so a write queued behind reset_database() goes to the new database file.
+    """
+    with _writelock:
+        cursor = _get_cursor()
+        with cursor.connection:
+            yield cursor
+
+
+def _stream_rows(sql: str, params: tuple):
+    """
+    This generator runs a SELECT query when it is first advanced (yielding None), then yields its rows
+    as they are fetched, holding its read open until they’re exhausted or the generator is discarded.
+    """
+    with _reading() as cursor:
+        # A cursor of its own keeps other queries from clobbering the rows before they’re consumed.
+        rows = cursor.connection.execute(sql, params)
+        yield None
+        yield from rows
+
+
+@atexit.register
+def _optimize_database() -> None:
+    """This function lets SQLite update its query planner statistics when ShootPoints shuts down."""
+    with _connectionslock:
+        conn = next(iter(_connections), None)
+        if conn is not None:
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+
+
+def __getattr__(name: str):
+    """This function gives other modules the database connection and cursor belonging to the calling thread."""
+    if name == "cursor":
+        return _get_cursor()
+    if name == "dbconn":
+        return _get_cursor().connection
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@lru_cache(maxsize=256)
+def _get_query_type(sql: str) -> str:
+    """
+    This function returns the first keyword of the given sql in upper case (e.g., "SELECT"). The
+    helpers below check every query with it, and it is cached as their queries are constant strings.
+    """
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
 
 
 def _save_to_database(sql: str, data: tuple) -> dict:
     """This function performs an INSERT or UPDATE of the given data using the provided query string."""
     outcome = {"errors": [], "result": ""}
-    if sql[:11].upper().find("INSERT INTO") == 0 or sql[:6].upper().find("UPDATE") == 0:
+    if _get_query_type(sql) in ("INSERT", "UPDATE"):
         try:
-            cursor.execute(sql, data)
-            dbconn.commit()
+            with _writing() as cursor:
+                cursor.execute(sql, data)
             outcome["result"] = "Data successfully saved to the database."
         except sqlite3.Error as err:
             outcome["errors"].append(str(err))
@@ -43,25 +247,107 @@ def _save_to_database(sql: str, data: tuple) -> dict:
 def _read_from_database(sql: str, params: tuple = ()) -> dict:
     """This function performs a SELECT query on the database, with optional parameters."""
     outcome = {"errors": [], "results": []}
-    if sql[:6].upper().find("SELECT") == 0:
+    if _get_query_type(sql) == "SELECT":
         try:
-            cursor.execute(sql, params)
-            outcome["results"].extend([dict(row) for row in cursor.fetchall()])
+            with _reading() as cursor:
+                rows = cursor.execute(sql, params).fetchall()
         except sqlite3.Error as err:
             outcome["errors"].append(str(err))
+        else:
+            # Nearly every request reads from the database, so a successful outcome is built as it will
+            # be returned, rather than being trimmed down by format_outcome().
+            return {"results": [dict(row) for row in rows]}
     else:
         outcome["errors"].append("The given sql does not appear to be a SELECT query.")
     return format_outcome(outcome, ["results"])
 
 
+def _read_rows(sql: str, params: tuple = ()) -> list:
+    """
+    This function returns the rows of a SELECT query as sqlite3.Row objects, without converting them
+    to dicts, or an empty list if the query fails. It is for large internal reads, such as copying data
+    between tables, whose rows are only read by key or position and are never returned through the API.
+    """
+    if _get_query_type(sql) == "SELECT":
+        try:
+            with _reading() as cursor:
+                return cursor.execute(sql, params).fetchall()
+        except sqlite3.Error:
+            pass
+    return []
+
+
+def _iter_rows(sql: str, params: tuple = ()):
+    """
+    This function returns the rows of a SELECT query like _read_rows(), but as an iterator that fetches
+    them from the database as it is looped through, so that a large result set is never held in memory.
+    """
+    if _get_query_type(sql) == "SELECT":
+        rows = _stream_rows(sql, params)
+        try:
+            next(rows)
+        except sqlite3.Error:
+            pass
+        else:
+            return rows
+    return iter(())
+
+
+def _iter_from_database(sql: str, params: tuple = ()) -> dict:
+    """
+    This function performs a SELECT query like _read_from_database(), but its results are a generator
+    of row dicts, for large result sets that the caller only needs to loop through once.
+    """
+    outcome = {"errors": [], "results": []}
+    if _get_query_type(sql) == "SELECT":
+        rows = _stream_rows(sql, params)
+        try:
+            next(rows)
+        except sqlite3.Error as err:
+            outcome["errors"].append(str(err))
+        else:
+            outcome["results"] = (dict(row) for row in rows)
+    else:
+        outcome["errors"].append("The given sql does not appear to be a SELECT query.")
+    return format_outcome(outcome, ["results"])
+
+
+def _read_scalar(sql: str, params: tuple = ()):
+    """
+    This function returns the first column of the first row of a SELECT query, or None if there is
+    no such row or the query fails. It skips building dicts for callers that only need one value.
+    """
+    if _get_query_type(sql) == "SELECT":
+        try:
+            with _reading() as cursor:
+                row = cursor.execute(sql, params).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is not None:
+            return row[0]
+    return None
+
+
 def _delete_from_database(sql: str, params: tuple) -> dict:
-    """This function deletes data from the database"""
-    outcome = {"errors": [], "result": ""}
-    if sql[:6].upper().find("DELETE") == 0:
+    """
+    This function deletes data from the database. If the query ends with a RETURNING clause,
+    the deleted rows are given in the outcome’s results.
+    """
+    outcome = {"errors": [], "result": "", "results": []}
+    if _get_query_type(sql) == "DELETE":
         try:
-            cursor.execute(sql, params)
-            dbconn.commit()
-            affected = cursor.rowcount
+            with _writing() as cursor:
+                if not _HASRETURNING and " RETURNING " in sql:
+                    # Read the rows to be deleted first, then delete them without the RETURNING clause.
+                    sql, _, columns = sql.partition(" RETURNING ")
+                    rows = cursor.execute(
+                        f"SELECT {columns} FROM {sql.lstrip()[12:]}", params
+                    ).fetchall()
+                    cursor.execute(sql, params)
+                else:
+                    rows = cursor.execute(sql, params).fetchall()
+                affected = cursor.rowcount
+            outcome["results"] = [dict(row) for row in rows]
             if affected == 1:
                 outcome["result"] = f"1 row was deleted."
             else:
@@ -73,84 +359,167 @@ def _delete_from_database(sql: str, params: tuple) -> dict:
     return format_outcome(outcome, ["results"])
 
 
-def _record_setup_error(error: str) -> None:
-    sql = "INSERT INTO setuperrors (error) VALUES (?)"
+def _delete_all_from_database(statements: list) -> dict:
+    """
+    This function performs several (sql, params) DELETE queries in one transaction, which is
+    committed once, and only if every one of them succeeds.
+    """
+    outcome = {"errors": [], "result": ""}
+    if all(_get_query_type(sql) == "DELETE" for sql, _ in statements):
+        try:
+            affected = 0
+            with _writing() as cursor:
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+                    affected += cursor.rowcount
+            # The count is the total across all the statements, which usually delete several rows.
+            if affected == 1:
+                outcome["result"] = "1 row was deleted."
+            else:
+                outcome["result"] = f"{affected} rows were deleted."
+        except sqlite3.Error as err:
+            outcome["errors"].append(str(err))
+    else:
+        outcome["errors"].append("The given sql does not appear to be a DELETE query.")
+    return format_outcome(outcome, ["results"])
+
+
+def _record_setup_errors(errors: list) -> None:
+    global _setuperrors
+    # Errors that were already recorded are skipped by SQLite, rather than failing the whole batch.
+    sql = "INSERT OR IGNORE INTO setuperrors (error) VALUES (?)"
+    _setuperrors = None
     try:
-        cursor.execute(sql, (error,))
-        dbconn.commit()
-    except sqlite3.IntegrityError:
+        with _writing() as cursor:
+            cursor.executemany(sql, [(error,) for error in errors])
+    except sqlite3.Error:
         pass
 
 
 def _clear_setup_errors() -> None:
+    global _setuperrors
+    if _setuperrors == []:
+        # There is nothing to delete, so skip the write and commit.
+        return
     try:
-        cursor.execute("DELETE FROM setuperrors")
-        dbconn.commit()
-    except:
-        pass
+        with _writing() as cursor:
+            cursor.execute("DELETE FROM setuperrors")
+        _setuperrors = []
+    except sqlite3.Error:
+        _setuperrors = None
 
 
 def get_setup_errors() -> dict:
-    """This function returns any setup errors logged on app load."""
-    outcome = _read_from_database("SELECT * FROM setuperrors")
-    if "errors" not in outcome:
-        outcome["errors"] = []
+    """
+    This function returns any setup errors logged on app load. They only change when the app is
+    (re)loaded, so they’re cached until the next time errors are recorded or cleared.
+    """
+    global _setuperrors
+    if _setuperrors is None:
+        # Only the one column is needed, so it’s read from the rows directly rather than via dicts.
         try:
-            for each in outcome["results"]:
-                outcome["errors"].append(each["error"])
-        except:
-            pass
-        outcome["results"] = "ShootPoints is ready for use."
+            with _reading() as cursor:
+                rows = cursor.execute("SELECT error FROM setuperrors").fetchall()
+        except sqlite3.Error as err:
+            return format_outcome({"errors": [str(err)], "results": []}, ["results"])
+        _setuperrors = [row[0] for row in rows]
+    outcome = {"errors": list(_setuperrors), "results": "ShootPoints is ready for use."}
     return format_outcome(outcome)
 
 
-def reset_database(
-    preservesitesandstations: bool = True, preserveclassesandsubclasses: bool = True
-) -> dict:
-    """This function creates a new blank database, optionally with some data saved from the current one."""
-    global dbconn
-    global cursor
-    outcome = end_current_session()
-    # Cache sites, stations, classes, and subclasses if requested
-    cachedsites = []
-    cachedstations = []
-    cachedclasses = []
-    cachedsubclasses = []
-    if preservesitesandstations:
-        cachedsites = _read_from_database("SELECT * FROM sites")["results"]
-        cachedstations = _read_from_database("SELECT * FROM stations")["results"]
-    if preserveclassesandsubclasses:
-        cachedclasses = _read_from_database("SELECT * FROM classes")["results"]
-        cachedsubclasses = _read_from_database("SELECT * FROM subclasses")["results"]
-    # Back up the current database to the backups folder and restore a pristine copy
-    dbconn.close()
+def _copy_database_to(path: str) -> None:
+    """
+    This function writes a complete copy of the database to the given file, with SQLite’s backup API,
+    which includes the rows that are still in the WAL. Writes are held off while it runs, so the copy
+    is of a single, consistent state of the database.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    copy = sqlite3.connect(path)
+    try:
+        with _writelock, _reading() as cursor:
+            cursor.connection.backup(copy)
+    finally:
+        copy.close()
+
+
+def _replace_database_file(
+    sites: list, stations: list, classes: Optional[list], subclasses: list
+) -> None:
+    """
+    This function backs up ShootPoints.db to the backups folder and replaces it with a pristine copy,
+    into which the given rows are restored. The classes and subclasses are only replaced if classes
+    is not None. reset_database() calls it with writes and reads held off.
+    """
+    # Closing every connection checkpoints the WAL into ShootPoints.db before it is backed up.
+    _close_connections()
     thedatetime = str(datetime.datetime.now()).split(".")[0].replace(":", "-")
     shutil.copy2(
         "ShootPoints.db", str(Path("backups") / f"ShootPoints ({thedatetime}).db")
     )
     os.remove("ShootPoints.db")
-    dbconn = sqlite3.connect("ShootPoints.db", check_same_thread=False)
-    dbconn.row_factory = sqlite3.Row
-    cursor = dbconn.cursor()
-    with open("blank_database.sql", "r") as f:
-        cursor.executescript(f.read())
-        dbconn.commit()
-        cursor.execute("PRAGMA foreign_keys = ON")
-    # Restore cached data
-    sql = "INSERT INTO sites (id, name, description) VALUES (?, ?, ?)"
-    cursor.executemany(sql, [tuple(each.values()) for each in cachedsites])
-    sql = "INSERT INTO stations (id, sites_id, name, description, northing, easting, elevation, utmzone, latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-    cursor.executemany(sql, [tuple(each.values()) for each in cachedstations])
-    if preserveclassesandsubclasses:
-        cursor.execute("DELETE FROM subclasses")
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name='subclasses'")
-        cursor.execute("DELETE FROM classes")
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name='classes'")
-        sql = "INSERT INTO classes (id, name, description) VALUES (?, ?, ?)"
-        cursor.executemany(sql, [tuple(each.values()) for each in cachedclasses])
-        sql = "INSERT INTO subclasses (id, classes_id, name, description) VALUES (?, ?, ?, ?)"
-        cursor.executemany(sql, [tuple(each.values()) for each in cachedsubclasses])
-    dbconn.commit()
+    conn = _connect()
+    try:
+        _get_blank_database().backup(conn)
+        # Restore cached data, as one transaction that is committed when the block ends (or rolled back on error)
+        with conn:
+            sql = "INSERT INTO sites (id, name, description) VALUES (?, ?, ?)"
+            conn.executemany(sql, sites)
+            sql = "INSERT INTO stations (id, sites_id, name, description, northing, easting, elevation, utmzone, latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            conn.executemany(sql, stations)
+            if classes is not None:
+                conn.execute("DELETE FROM subclasses")
+                conn.execute("DELETE FROM sqlite_sequence WHERE name='subclasses'")
+                conn.execute("DELETE FROM classes")
+                conn.execute("DELETE FROM sqlite_sequence WHERE name='classes'")
+                sql = "INSERT INTO classes (id, name, description) VALUES (?, ?, ?)"
+                conn.executemany(sql, classes)
+                sql = "INSERT INTO subclasses (id, classes_id, name, description) VALUES (?, ?, ?, ?)"
+                conn.executemany(sql, subclasses)
+    finally:
+        conn.close()
+
+
+def reset_database(
+    preservesitesandstations: bool = True, preserveclassesandsubclasses: bool = True
+) -> dict:
+    """This function creates a new blank database, optionally with some data saved from the current one."""
+    global _generation
+    outcome = end_current_session()
+    # Writes are held off from here until the new database is in place, so that none of them can be made
+    # to the old file after the preserved data has been read from it, or be lost with it.
+    with _writelock:
+        # Cache sites, stations, classes, and subclasses if requested
+        # Note: the rows are kept as sqlite3.Row sequences in the order of the INSERT columns below,
+        # so they can be passed straight back to executemany().
+        cachedsites = []
+        cachedstations = []
+        cachedclasses = []
+        cachedsubclasses = []
+        if preservesitesandstations:
+            cachedsites = _read_rows("SELECT id, name, description FROM sites")
+            cachedstations = _read_rows(
+                "SELECT id, sites_id, name, description, northing, easting, elevation, utmzone, latitude, longitude FROM stations"
+            )
+        if preserveclassesandsubclasses:
+            cachedclasses = _read_rows("SELECT id, name, description FROM classes")
+            cachedsubclasses = _read_rows(
+                "SELECT id, classes_id, name, description FROM subclasses"
+            )
+        # Reads are held off too, once those in progress have finished, so that no connection is closed
+        # under them and none is reopened until the new file is complete and the generation is bumped.
+        with _holding_off_reads():
+            try:
+                _replace_database_file(
+                    cachedsites,
+                    cachedstations,
+                    cachedclasses if preserveclassesandsubclasses else None,
+                    cachedsubclasses,
+                )
+            finally:
+                # Every thread (this one included) reconnects on its next use of the database.
+                with _connectionslock:
+                    _generation += 1
     # Return result message
     outcome["result"] = "Database replaced with pristine copy."
     if preservesitesandstations and preserveclassesandsubclasses:
@@ -2,11 +2,11 @@
 
 import csv
 import datetime
-import glob
 import json
-import os
 import shapefile
 import shutil
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 from zipfile import ZipFile, ZIP_DEFLATED
 
@@ -48,37 +48,41 @@ gcpfiles = [
 ]
 
 
-def export_database_file() -> None:
-    """This function creates a ZIP file of the ShootPoints database file, for download by the browser."""
+def export_database_file(exportdir: str) -> str:
+    """
+    This function creates a ZIP file of the ShootPoints database file in the given directory, for download
+    by the browser, and returns its date.
+    """
     date = str(datetime.datetime.now()).split(" ")[0]
+    # ShootPoints.db itself may be missing committed rows that are still in its write-ahead log,
+    # so a complete copy of the database is archived instead.
+    databasecopy = str(Path(exportdir) / "ShootPoints.db")
+    database._copy_database_to(databasecopy)
     with ZipFile(
-        str(Path("exports") / "database.zip"), "w", compression=ZIP_DEFLATED
+        str(Path(exportdir) / "database.zip"), "w", compression=ZIP_DEFLATED
     ) as f:
         f.write(
-            "ShootPoints.db",
+            databasecopy,
             arcname=str(Path(f"ShootPoints Database {date}") / "ShootPoints.db"),
         )
+    return date
 
 
-def export_session_data(sessions_id: int) -> None:
-    """This function creates a ZIP file of a session and its shots, for download by the browser."""
+def export_session_data(sessions_id: int, exportdir: str) -> None:
+    """
+    This function creates a ZIP file of a session and its shots in the given directory, for download
+    by the browser.
+    """
     spatialcontrol = []
-    allshots = []
     pointclouds = []
     openpolygons = []
     closedpolygons = []
-    thisgroupinfo = {}
-    thisgroupgeometry = ""
-    shotsinthisgroup = []
     gcps = []
-
-    def _assemble_group():
-        if thisgroupgeometry == "Point Cloud":
-            pointclouds.append([dict(**thisgroupinfo), shotsinthisgroup])
-        elif thisgroupgeometry == "Open Polygon":
-            openpolygons.append([dict(**thisgroupinfo), shotsinthisgroup])
-        elif thisgroupgeometry == "Closed Polygon":
-            closedpolygons.append([dict(**thisgroupinfo), shotsinthisgroup])
+    groupsbygeometry = {
+        "Point Cloud": pointclouds,
+        "Open Polygon": openpolygons,
+        "Closed Polygon": closedpolygons,
+    }
 
     # First, get information about the session, and save it to a JSON file.
     sql = (
@@ -216,9 +220,20 @@ def export_session_data(sessions_id: int) -> None:
                 "Z": resection_station_right["elevation"],
             }
         )
-    with open(str(Path("exports") / "session_info.json"), "w", encoding="utf8") as f:
+    with open(str(Path(exportdir) / "session_info.json"), "w", encoding="utf8") as f:
         f.write(json.dumps(session, ensure_ascii=False, indent=2))
 
+    # The shapefiles all share the projection of the occupied station’s UTM zone, if it has one.
+    prjfile = (
+        str(
+            Path("core")
+            / "prj_templates"
+            / f"{sessiondata['occupied_station_utmzone']}.txt"
+        )
+        if sessiondata["occupied_station_utmzone"]
+        else ""
+    )
+
     # Next, get all the shots in the session, and handle them accordingly.
     if sessiondata["data_number_of_shots"] > 0:
         sql = (
@@ -242,7 +257,6 @@ def export_session_data(sessions_id: int) -> None:
             "  sh.prismoffset_longitude, "
             "  sh.prismoffset_radial, "
             "  sh.prismoffset_tangent, "
-            "  sh.prismoffset_vertical, "
             "  sh.prismoffset_wedge, "
             "  sh.northing, "
             "  sh.easting, "
@@ -252,79 +266,99 @@ def export_session_data(sessions_id: int) -> None:
             "JOIN subclasses scl ON grp.subclasses_id = scl.id "
             "JOIN classes cls ON scl.classes_id = cls.id "
             "JOIN shots sh ON sh.groupings_id = grp.id "
-            "WHERE grp.sessions_id = ?"
+            "WHERE grp.sessions_id = ? "
+            "ORDER BY grp.id, sh.id"
         )
-        shotsdata = database._read_from_database(sql, (sessions_id,))["results"]
-        # Save all shots to a flat CSV file.
+        # The shots are streamed from the database cursor straight into the flat CSV file and the
+        # allshots shapefile. Only the current grouping's shots are held in memory, and they're sorted
+        # by grouping, so groupby() hands each grouping's shots over together.
         with open(
-            str(Path("exports") / "shots_data.csv"), "w", encoding="utf8", newline=""
-        ) as f:
-            shotsfile = csv.DictWriter(f, fieldnames=shotsdata[0].keys())
-            shotsfile.writeheader()
-            shotsfile.writerows(shotsdata)
-        # Parse shotsdata to build the shapefiles and GCP files.
-        for eachshot in shotsdata:
-            if (
-                not "group_id" in thisgroupinfo
-                # This is the first shot in shotsdata.
-                or eachshot["group_id"] != thisgroupinfo["group_id"]
-                # This is the first shot in a new grouping.
+            str(Path(exportdir) / "shots_data.csv"), "w", encoding="utf8", newline=""
+        ) as f, shapefile.Writer(
+            str(Path(exportdir) / "gis_shapefiles_allshots"), shapeType=shapefile.POINTZ
+        ) as w:
+            shotsfile = csv.writer(f)
+            w.field("group_id", "N")
+            w.field("shot_id", "N")
+            w.field("label", "C")
+            w.field("descr", "C")
+            w.field("class", "C")
+            w.field("subclass", "C")
+            w.field("comment", "C")
+            w.field("timestamp", "C")
+            w.field("N", "N", decimal=3)
+            w.field("E", "N", decimal=3)
+            w.field("Z", "N", decimal=3)
+            shotsdata = database._iter_rows(sql, (sessions_id,))
+            for groupnumber, (group_id, groupshots) in enumerate(
+                groupby(shotsdata, key=itemgetter("group_id"))
             ):
-                _assemble_group()
-                thisgroupgeometry = eachshot["geometry"]
-                thisgroupinfo = {
-                    "group_id": eachshot["group_id"],
-                    "label": eachshot["label"],
-                    "descr": eachshot["description"],
-                    "class": eachshot["class"],
-                    "subclass": eachshot["subclass"],
-                }
+                groupshots = list(groupshots)
+                firstshot = groupshots[0]
+                if not groupnumber:
+                    shotsfile.writerow(firstshot.keys())
+                shotsfile.writerows(groupshots)
+                # The grouping’s coordinates are filled in below, as its shots are parsed.
                 shotsinthisgroup = []
-            shotsinthisgroup.append(
-                [eachshot["easting"], eachshot["northing"], eachshot["elevation"]]
-            )
-            allshots.append(
-                {
-                    "group_id": eachshot["group_id"],
-                    "shot_id": eachshot["shot_id"],
-                    "label": eachshot["label"],
-                    "descr": eachshot["description"],
-                    "class": eachshot["class"],
-                    "subclass": eachshot["subclass"],
-                    "comment": eachshot["comment"],
-                    "timestamp": eachshot["timestamp"],
-                    "N": eachshot["northing"],
-                    "E": eachshot["easting"],
-                    "Z": eachshot["elevation"],
-                }
-            )
-            # Assemble a list of all the GCPs in this session.
-            if eachshot["subclass"] == "GCP":
-                label = eachshot["label"].replace(" ", "_").replace(",", "_")
-                gcps.append(
-                    {
-                        "label": label,
-                        "N": eachshot["northing"],
-                        "E": eachshot["easting"],
-                        "X": eachshot["easting"],
-                        "Y": eachshot["northing"],
-                        "Z": eachshot["elevation"],
-                    }
+                if firstshot["geometry"] in groupsbygeometry:
+                    groupsbygeometry[firstshot["geometry"]].append(
+                        [
+                            {
+                                "group_id": group_id,
+                                "label": firstshot["label"],
+                                "descr": firstshot["description"],
+                                "class": firstshot["class"],
+                                "subclass": firstshot["subclass"],
+                            },
+                            shotsinthisgroup,
+                        ]
+                    )
+                for eachshot in groupshots:
+                    shotsinthisgroup.append(
+                        [
+                            eachshot["easting"],
+                            eachshot["northing"],
+                            eachshot["elevation"],
+                        ]
+                    )
+                    w.record(
+                        group_id,
+                        eachshot["shot_id"],
+                        eachshot["label"],
+                        eachshot["description"],
+                        eachshot["class"],
+                        eachshot["subclass"],
+                        eachshot["comment"],
+                        eachshot["timestamp"],
+                        eachshot["northing"],
+                        eachshot["easting"],
+                        eachshot["elevation"],
+                    )
+                    w.pointz(
+                        eachshot["easting"], eachshot["northing"], eachshot["elevation"]
+                    )
+                    # Assemble a list of all the GCPs in this session.
+                    if eachshot["subclass"] == "GCP":
+                        label = eachshot["label"].replace(" ", "_").replace(",", "_")
+                        gcps.append(
+                            {
+                                "label": label,
+                                "N": eachshot["northing"],
+                                "E": eachshot["easting"],
+                                "X": eachshot["easting"],
+                                "Y": eachshot["northing"],
+                                "Z": eachshot["elevation"],
+                            }
+                        )
+            if prjfile:
+                shutil.copy2(
+                    prjfile,
+                    str(Path(exportdir) / "gis_shapefiles_allshots.prj"),
                 )
-        _assemble_group()  # This terminates a multi-point group that's at the end of the file
 
-    # Then save the shapefiles and GCP files.
-    prjfile = (
-        str(
-            Path("core")
-            / "prj_templates"
-            / f"{sessiondata['occupied_station_utmzone']}.txt"
-        )
-        if sessiondata["occupied_station_utmzone"]
-        else ""
-    )
+    # Then save the other shapefiles and the GCP files.
     with shapefile.Writer(
-        str(Path("exports") / "gis_shapefiles_spatialcontrol"),
+        str(Path(exportdir) / "gis_shapefiles_spatialcontrol"),
         shapeType=shapefile.POINTZ,
     ) as w:
         w.field("id", "N")
@@ -340,34 +374,11 @@ def export_session_data(sessions_id: int) -> None:
         if prjfile:
             shutil.copy2(
                 prjfile,
-                str(Path("exports") / "gis_shapefiles_spatialcontrol.prj"),
+                str(Path(exportdir) / "gis_shapefiles_spatialcontrol.prj"),
             )
-    if allshots:
-        with shapefile.Writer(
-            str(Path("exports") / "gis_shapefiles_allshots"), shapeType=shapefile.POINTZ
-        ) as w:
-            w.field("group_id", "N")
-            w.field("shot_id", "N")
-            w.field("label", "C")
-            w.field("descr", "C")
-            w.field("class", "C")
-            w.field("subclass", "C")
-            w.field("comment", "C")
-            w.field("timestamp", "C")
-            w.field("N", "N", decimal=3)
-            w.field("E", "N", decimal=3)
-            w.field("Z", "N", decimal=3)
-            for eachshot in allshots:
-                w.record(*tuple(eachshot.values()))
-                w.pointz(eachshot["E"], eachshot["N"], eachshot["Z"])
-            if prjfile:
-                shutil.copy2(
-                    prjfile,
-                    str(Path("exports") / "gis_shapefiles_allshots.prj"),
-                )
     if closedpolygons:
         with shapefile.Writer(
-            str(Path("exports") / "gis_shapefiles_closedpolygons"),
+            str(Path(exportdir) / "gis_shapefiles_closedpolygons"),
             shapeType=shapefile.POLYGONZ,
         ) as w:
             w.field("group_id", "N")
@@ -381,11 +392,11 @@ def export_session_data(sessions_id: int) -> None:
             if prjfile:
                 shutil.copy2(
                     prjfile,
-                    str(Path("exports") / "gis_shapefiles_closedpolygons.prj"),
+                    str(Path(exportdir) / "gis_shapefiles_closedpolygons.prj"),
                 )
     if openpolygons:
         with shapefile.Writer(
-            str(Path("exports") / "gis_shapefiles_openpolygons"),
+            str(Path(exportdir) / "gis_shapefiles_openpolygons"),
             shapeType=shapefile.POLYLINEZ,
         ) as w:
             w.field("group_id", "N")
@@ -399,11 +410,11 @@ def export_session_data(sessions_id: int) -> None:
             if prjfile:
                 shutil.copy2(
                     prjfile,
-                    str(Path("exports") / "gis_shapefiles_openpolygons.prj"),
+                    str(Path(exportdir) / "gis_shapefiles_openpolygons.prj"),
                 )
     if pointclouds:
         with shapefile.Writer(
-            str(Path("exports") / "gis_shapefiles_pointclouds"),
+            str(Path(exportdir) / "gis_shapefiles_pointclouds"),
             shapeType=shapefile.MULTIPOINTZ,
         ) as w:
             w.field("group_id", "N")
@@ -417,11 +428,11 @@ def export_session_data(sessions_id: int) -> None:
             if prjfile:
                 shutil.copy2(
                     prjfile,
-                    str(Path("exports") / "gis_shapefiles_pointclouds.prj"),
+                    str(Path(exportdir) / "gis_shapefiles_pointclouds.prj"),
                 )
     if gcps:
         for eachfile in gcpfiles:
-            _write_gcps_to_file(eachfile, sessiondata, gcps)
+            _write_gcps_to_file(eachfile, sessiondata, gcps, exportdir)
 
     # Finally, bundle up all the export files into a ZIP archive for download.
     filesinarchive = [
@@ -446,30 +457,26 @@ def export_session_data(sessions_id: int) -> None:
         )
     archivename = f"ShootPoints Data ({sessiondata['session_label'].replace('/', '_').replace(':', '_').replace('\\', '_')})"
     with ZipFile(
-        str(Path("exports") / "export.zip"), "w", compression=ZIP_DEFLATED
+        str(Path(exportdir) / "export.zip"), "w", compression=ZIP_DEFLATED
     ) as f:
         for eachfile in filesinarchive:
             try:
                 f.write(
                     str(
-                        Path("exports")
+                        Path(exportdir)
                         / f"{eachfile.replace('/', '_').replace('\\', '_')}"
                     ),
                     arcname=str(Path(archivename) / eachfile),
                 )
             except FileNotFoundError:
                 pass
-    cleanup = []
-    for eachfiletype in ["csv", "dbf", "json", "prj", "shp", "shx", "txt"]:
-        cleanup.extend(glob.glob(str(Path("exports") / f"*.{eachfiletype}")))
-    for eachfile in cleanup:
-        os.remove(eachfile)
 
 
 def _write_gcps_to_file(
     fileinfo: dict,
     session: dict,
     gcps: list,
+    exportdir: str,
 ) -> None:
     """This function writes a CSV or text file with the parameters given."""
     if not fileinfo["headers"]:
@@ -486,7 +493,7 @@ def _write_gcps_to_file(
         ]
     with open(
         str(
-            Path("exports")
+            Path(exportdir)
             / f"photogrammetry_gcps_gcps_for_{fileinfo['name']}.{fileinfo['type']}"
         ),
         "w",
@@ -494,26 +501,19 @@ def _write_gcps_to_file(
         newline="",
     ) as f:
         if fileinfo["type"] == "csv":
-            gcpfile = csv.DictWriter(
-                f,
-                fieldnames=headers,
-            )
+            # The rows are written in the headers’ order, so they don’t need to be zipped into dicts.
+            gcpfile = csv.writer(f)
             if fileinfo["headers"]:
-                gcpfile.writeheader()
-            for eachgcp in gcps:
-                gcpfile.writerow(
-                    dict(
-                        zip(
-                            headers,
-                            [
-                                eachgcp["label"],
-                                eachgcp[fileinfo["coords"][0]],
-                                eachgcp[fileinfo["coords"][1]],
-                                eachgcp[fileinfo["coords"][2]],
-                            ],
-                        )
-                    )
+                gcpfile.writerow(headers)
+            gcpfile.writerows(
+                (
+                    eachgcp["label"],
+                    eachgcp[fileinfo["coords"][0]],
+                    eachgcp[fileinfo["coords"][1]],
+                    eachgcp[fileinfo["coords"][2]],
                 )
+                for eachgcp in gcps
+            )
         elif fileinfo["type"] == "txt":
             for eachline in headers:
                 f.write(f"{eachline}\n")
@@ -20,9 +20,9 @@ def save_site(name: str, description: Optional[str] = None) -> dict:
     outcome = {"errors": [], "result": ""}
     name = name.strip()
     description = description.strip() if description else None
-    if database._read_from_database(
+    if database._read_scalar(
         "SELECT count(*) FROM sites WHERE upper(name) = ?", (name.upper(),)
-    )["results"][0]["count(*)"]:
+    ):
         outcome["errors"].append(f"The site name “{name}” is already taken.")
     if not outcome["errors"]:
         sql = f"INSERT INTO sites (name, description) VALUES (?, ?)"
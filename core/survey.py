@@ -26,6 +26,30 @@ resection_backsight_1 = {}
 resection_backsight_2 = {}
 resection_backsight_1_measurement = {}
 
+# Statements run on every new session or shot are kept constant (with the timestamp bound as a
+# parameter) so that sqlite3 can reuse its compiled form from the connection’s statement cache.
+_INSERTSESSIONSQL = (
+    "INSERT INTO sessions ("
+    " label,"
+    " started,"
+    " surveyor,"
+    " stations_id_occupied,"
+    " stations_id_backsight,"
+    " stations_id_resection_left,"
+    " stations_id_resection_right,"
+    " azimuth,"
+    " instrumentheight,"
+    " pressure,"
+    " temperature"
+    ") VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_SAVECURRENTSESSIONSQL = "UPDATE savedstate SET currentsession = ?"
+_INSERTSHOTSQL = (
+    "INSERT INTO shots "
+    "(timestamp, delta_n, delta_e, delta_z, northing, easting, elevation, pressure, temperature, prismoffset_vertical, prismoffset_latitude, prismoffset_longitude, prismoffset_radial, prismoffset_tangent, prismoffset_wedge, groupings_id, comment) "
+    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
 
 def _get_timestamp() -> str:
     """This function returns the current timestamp, formatted for saving in the database."""
@@ -37,27 +61,12 @@ def _save_new_session(data: tuple) -> Optional[int]:
     global sessionid
     global groupingid
     global activeshotdata
-    sql = (
-        "INSERT INTO sessions ("
-        " label,"
-        " started,"
-        " surveyor,"
-        " stations_id_occupied,"
-        " stations_id_backsight,"
-        " stations_id_resection_left,"
-        " stations_id_resection_right,"
-        " azimuth,"
-        " instrumentheight,"
-        " pressure,"
-        " temperature"
-        f") VALUES(?, '{_get_timestamp()}', ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    saved = database._save_to_database(
+        _INSERTSESSIONSQL, (data[0], _get_timestamp()) + data[1:]
     )
-    saved = database._save_to_database(sql, data)
     if "errors" not in saved:
         sessionid = database.cursor.lastrowid
-        _ = database._save_to_database(
-            "UPDATE savedstate SET currentsession = ?", (sessionid,)
-        )
+        _ = database._save_to_database(_SAVECURRENTSESSIONSQL, (sessionid,))
     else:
         sessionid = 0
     activeshotdata = {}
@@ -284,26 +293,24 @@ def start_surveying_session_with_backsight(
         if "errors" in prismoffsets:
             outcome["errors"].extend(prismoffsets["errors"])
 
-    # get the occupied point coordinates
+    # get the occupied point and backsight station coordinates together
     occupied_n, occupied_e, occupied_z = 0, 0, 0
-    occupiedpoint = tripod.get_station(sites_id, occupied_point_id)
-    if "errors" in occupiedpoint:
-        outcome["errors"].extend(occupiedpoint["errors"])
-    else:
-        occupied_n = occupiedpoint["station"]["northing"]
-        occupied_e = occupiedpoint["station"]["easting"]
-        occupied_z = occupiedpoint["station"]["elevation"]
-        utmzone = occupiedpoint["station"]["utmzone"]
-
-    # get the backsight station coordinates
     backsight_n, backsight_e, backsight_z = 0, 0, 0
-    backsightstation = tripod.get_station(sites_id, backsight_station_id)
-    if "errors" in backsightstation:
-        outcome["errors"].extend(backsightstation["errors"])
+    stations = tripod._get_stations_by_id(
+        sites_id, (occupied_point_id, backsight_station_id)
+    )
+    if "errors" in stations:
+        outcome["errors"].extend(stations["errors"])
     else:
-        backsight_n = backsightstation["station"]["northing"]
-        backsight_e = backsightstation["station"]["easting"]
-        backsight_z = backsightstation["station"]["elevation"]
+        occupiedpoint = stations["stations"][occupied_point_id]
+        occupied_n = occupiedpoint["northing"]
+        occupied_e = occupiedpoint["easting"]
+        occupied_z = occupiedpoint["elevation"]
+        utmzone = occupiedpoint["utmzone"]
+        backsightstation = stations["stations"][backsight_station_id]
+        backsight_n = backsightstation["northing"]
+        backsight_e = backsightstation["easting"]
+        backsight_z = backsightstation["elevation"]
 
     # stop execution if there were any errors setting the atmospheric conditions, occupied point, backsight station, or prism height
     if outcome["errors"]:
@@ -530,24 +537,30 @@ def start_surveying_session_with_resection(
             return None
 
         # calculate the coordinates of the occupied point
-        occupied_point_ne_coords = calculations._calculate_coordinates_by_resection(
-            (
-                resection_backsight_1["station"]["easting"],
-                resection_backsight_1["station"]["northing"],
-            ),
-            (
-                resection_backsight_2["station"]["easting"],
-                resection_backsight_2["station"]["northing"],
-            ),
-            math.hypot(
-                resection_backsight_1_measurement["measurement"]["delta_e"],
-                resection_backsight_1_measurement["measurement"]["delta_n"],
-            ),
-            math.hypot(
-                resection_backsight_2_measurement["measurement"]["delta_e"],
-                resection_backsight_2_measurement["measurement"]["delta_n"],
-            ),
-        )
+        try:
+            occupied_point_ne_coords = calculations._calculate_coordinates_by_resection(
+                (
+                    resection_backsight_1["station"]["easting"],
+                    resection_backsight_1["station"]["northing"],
+                ),
+                (
+                    resection_backsight_2["station"]["easting"],
+                    resection_backsight_2["station"]["northing"],
+                ),
+                math.hypot(
+                    resection_backsight_1_measurement["measurement"]["delta_e"],
+                    resection_backsight_1_measurement["measurement"]["delta_n"],
+                ),
+                math.hypot(
+                    resection_backsight_2_measurement["measurement"]["delta_e"],
+                    resection_backsight_2_measurement["measurement"]["delta_n"],
+                ),
+            )
+        except ValueError as err:
+            outcome["errors"].append(
+                f"The occupied point could not be calculated because {err}."
+            )
+            return None
         occupied_point_elevation = (
             occupied_point_z_left_reading + occupied_point_z_right_reading
         ) / 2
@@ -646,7 +659,7 @@ def end_current_session() -> dict:
         outcome = {"errors": [], "result": ""}
         sessionid = 0
         endcurrentsession = database._save_to_database(
-            "UPDATE savedstate SET currentsession = ?", (sessionid,)
+            _SAVECURRENTSESSIONSQL, (sessionid,)
         )
         if "errors" in endcurrentsession:
             outcome["errors"] = endcurrentsession["errors"]
@@ -770,20 +783,19 @@ def export_session_for_livemap(thesession: int = 0) -> dict:
         "WHERE groupings.sessions_id = ? "
         "ORDER BY groupings.id"
     )
-    surveydata = database._read_from_database(sql, (thesession,))
+    surveydata = database._iter_from_database(sql, (thesession,))
     if "errors" not in surveydata:
+        # Every shot shares the session’s UTM zone and false origin, so work them out once.
+        zonenumber = int(utmzone[:-1])
+        zoneletter = utmzone[-1]
+        falseorigin = 200000 if sitelocalcoords else 0
         shots = []
         for each_shot in surveydata["results"]:
-            northing = each_shot["northing"]
-            easting = each_shot["easting"]
-            if sitelocalcoords:
-                northing += 200000
-                easting += 200000
             lat, lon = calculations._convert_utm_to_latlon(
-                northing,
-                easting,
-                int(utmzone[:-1]),
-                utmzone[-1],
+                each_shot["northing"] + falseorigin,
+                each_shot["easting"] + falseorigin,
+                zonenumber,
+                zoneletter,
             )
             shots.append(
                 (
@@ -844,31 +856,22 @@ def delete_session(id: int) -> dict:
             "results"
         ]:  # This is an empty list if there are no matches for the above query.
             label = exists["results"][0]["label"]
-            groupings = [
-                str(x["id"])
-                for x in database._read_from_database(
-                    "SELECT id FROM groupings WHERE sessions_id = ?", (id,)
-                )["results"]
-            ]
-            shotsdeleted = database._delete_from_database(
-                f"DELETE FROM shots WHERE groupings_id in ({','.join(groupings)})", ()
+            # The session’s groupings are matched in SQL, rather than being read out and spliced back in,
+            # and all three deletions are committed together so that a failure can’t leave orphaned rows.
+            deleted = database._delete_all_from_database(
+                [
+                    (
+                        "DELETE FROM shots WHERE groupings_id IN (SELECT id FROM groupings WHERE sessions_id = ?)",
+                        (id,),
+                    ),
+                    ("DELETE FROM groupings WHERE sessions_id = ?", (id,)),
+                    ("DELETE FROM sessions WHERE id = ?", (id,)),
+                ]
             )
-            if "errors" not in shotsdeleted:
-                groupingsdeleted = database._delete_from_database(
-                    f"DELETE FROM groupings WHERE id in ({','.join(groupings)})", ()
-                )
-                if "errors" not in groupingsdeleted:
-                    sessiondeleted = database._delete_from_database(
-                        "DELETE FROM sessions WHERE id = ?", (id,)
-                    )
-                    if "errors" not in sessiondeleted:
-                        outcome["result"] = f"Session “{label}” successfully deleted."
-                    else:
-                        outcome["errors"].append(sessiondeleted["errors"])
-                else:
-                    outcome["errors"].append(groupingsdeleted["errors"])
+            if "errors" not in deleted:
+                outcome["result"] = f"Session “{label}” successfully deleted."
             else:
-                outcome["errors"].append(shotsdeleted["errors"])
+                outcome["errors"] = deleted["errors"]
         else:
             outcome["errors"].append(f"Session id {id} does not exist.")
     else:
@@ -1004,6 +1007,7 @@ def save_last_shot(comment: Optional[str] = None) -> dict:
     else:
         comment = comment.strip() if comment else None
         data = (
+            _get_timestamp(),
             activeshotdata["delta_n"],
             activeshotdata["delta_e"],
             activeshotdata["delta_z"],
@@ -1021,12 +1025,7 @@ def save_last_shot(comment: Optional[str] = None) -> dict:
             groupingid,
             comment,
         )
-        sql = (
-            "INSERT INTO shots "
-            "(timestamp, delta_n, delta_e, delta_z, northing, easting, elevation, pressure, temperature, prismoffset_vertical, prismoffset_latitude, prismoffset_longitude, prismoffset_radial, prismoffset_tangent, prismoffset_wedge, groupings_id, comment) "
-            f"VALUES('{_get_timestamp()}', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-        )
-        saved = database._save_to_database(sql, data)
+        saved = database._save_to_database(_INSERTSHOTSQL, data)
         if "errors" not in saved:
             outcome["result"] = "The last shot was saved."
             newstation = _save_shot_as_new_station()
@@ -1039,9 +1038,9 @@ def save_last_shot(comment: Optional[str] = None) -> dict:
                     )
             activeshotdata = {}
             if (
-                database._read_from_database(
+                database._read_scalar(
                     "SELECT geometries_id FROM groupings WHERE id = ?", (groupingid,)
-                )["results"][0]["geometries_id"]
+                )
                 == 1
             ):
                 # The active shot is an isolated point, so end the current grouping
@@ -13,15 +13,28 @@ TIMEOUT = 0
 ETX = chr(3)
 ACK = chr(6) + "006"
 
-# This property is set by core/__init__.py once the serial port has been initialized.
+# This property is set by core/__init__.py once the serial port has been initialized (but not opened).
 # To suppress Pylance warnings, “# type: ignore” is used below everywhere that it’s referenced.
 port = None
 
 _canceled = False
 
 
+def _open() -> bool:
+    """This function opens the serial port on first use, and returns whether it is open."""
+    if not port.is_open:  # type: ignore
+        try:
+            port.open()  # type: ignore
+        except OSError:
+            # The read that follows comes back empty, so callers report a communication error.
+            pass
+    return port.is_open  # type: ignore
+
+
 def _read(timeout: float) -> bytes:
     """This function reads all characters waiting in the serial port's buffer."""
+    if not _open():
+        return b""
     port.timeout = timeout  # type: ignore
     buffer = port.read_until(bytes(ETX, "ascii"))  # type: ignore
     return buffer
@@ -29,6 +42,8 @@ def _read(timeout: float) -> bytes:
 
 def _write(command: str) -> None:
     """This function blindly writes the command to the serial port."""
+    if not _open():
+        return
     port.write(bytes(command + ETX, "ascii"))  # type: ignore
     _clear_buffers()
 
@@ -101,25 +101,25 @@ def _validate_uniqueness_of_station(
     sites_id: int, name: str, northing: float, easting: float, errors: list
 ) -> None:
     """This function verifies that the station name is unique at this site, as is its northing and easting."""
+    # The site name and both uniqueness counts are fetched in a single round trip.
+    query = database._read_from_database(
+        "SELECT sites.name AS sitename, "
+        "(SELECT count(*) FROM stations WHERE sites_id = sites.id AND upper(stations.name) = ?) AS namematches, "
+        "(SELECT count(*) FROM stations WHERE sites_id = sites.id AND (? BETWEEN northing-0.1 AND northing+0.1) AND (? BETWEEN easting-0.1 AND easting+0.1)) AS coordinatematches "
+        "FROM sites WHERE sites.id = ?",
+        (name.upper(), northing, easting, sites_id),
+    )
     try:
-        sitename = database._read_from_database(
-            "SELECT name FROM sites WHERE id = ?", (sites_id,)
-        )["results"][0]["name"]
-    except:
-        sitename = None
-    if sitename:
-        if database._read_from_database(
-            "SELECT count(*) FROM stations WHERE sites_id = ? AND upper(name) = ?",
-            (sites_id, name.upper()),
-        )["results"][0]["count(*)"]:
+        site = query["results"][0]
+    except (KeyError, IndexError):
+        # There is no such site, or the query failed.
+        errors.append(f"There is no site with id {sites_id}.")
+    else:
+        sitename = site["sitename"]
+        if site["namematches"]:
             errors.append(f"The station name “{name}” is already taken at {sitename}.")
-        if database._read_from_database(
-            "SELECT count(*) FROM stations WHERE sites_id = ? AND (? BETWEEN northing-0.1 AND northing+0.1) AND (? BETWEEN easting-0.1 AND easting+0.1)",
-            (sites_id, northing, easting),
-        )["results"][0]["count(*)"]:
+        if site["coordinatematches"]:
             errors.append(f"The station coordinates are not unique at {sitename}.")
-    else:
-        errors.append(f"There is no site with id {sites_id}.")
 
 
 def _validate_instrument_height(height: float) -> str:
@@ -141,14 +141,7 @@ def _validate_instrument_height(height: float) -> str:
 def get_stations(sites_id: int) -> dict:
     """This function returns all the stations at the indicated site."""
     outcome = {"errors": [], "stations": {}}
-    if (
-        len(
-            database._read_from_database(
-                "SELECT id FROM sites WHERE id = ?", (sites_id,)
-            )["results"]
-        )
-        > 0
-    ):
+    if database._read_scalar("SELECT 1 FROM sites WHERE id = ?", (sites_id,)):
         query = database._read_from_database(
             "SELECT * FROM stations WHERE sites_id = ? ORDER BY name", (sites_id,)
         )
@@ -162,14 +155,7 @@ def get_stations(sites_id: int) -> dict:
 def get_station(sites_id: int, id: int) -> dict:
     """ "This function returns the name and coordinates of the indicated station."""
     outcome = {"errors": [], "station": {}}
-    if (
-        len(
-            database._read_from_database(
-                "SELECT id FROM sites WHERE id = ?", (sites_id,)
-            )["results"]
-        )
-        > 0
-    ):
+    if database._read_scalar("SELECT 1 FROM sites WHERE id = ?", (sites_id,)):
         query = database._read_from_database(
             "SELECT * FROM stations WHERE sites_id = ? AND id = ?",
             (
@@ -188,6 +174,34 @@ def get_station(sites_id: int, id: int) -> dict:
     return format_outcome(outcome)
 
 
+def _get_stations_by_id(sites_id: int, ids: tuple) -> dict:
+    """This function returns the indicated stations at the given site, keyed by id, using a single query."""
+    outcome = {"errors": [], "stations": {}}
+    sql = (
+        "SELECT sites.id AS siteid, sta.* "
+        "FROM sites "
+        "LEFT OUTER JOIN stations sta "
+        f"ON sta.sites_id = sites.id AND sta.id IN ({', '.join('?' * len(ids))}) "
+        "WHERE sites.id = ?"
+    )
+    query = database._read_from_database(sql, (*ids, sites_id))
+    if "errors" in query:
+        outcome["errors"].extend(query["errors"])
+    elif not query["results"]:
+        outcome["errors"].append(f"There is no site with id {sites_id}.")
+    else:
+        for each in query["results"]:
+            del each["siteid"]
+            if each["id"] is not None:
+                outcome["stations"][each["id"]] = each
+        for id in ids:
+            if id not in outcome["stations"]:
+                outcome["errors"].append(
+                    f"Station id {id} was not found at site {sites_id}."
+                )
+    return format_outcome(outcome)
+
+
 def save_new_station(
     sites_id: int,
     name: str,